@@ -0,0 +1,106 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Iterable
+
+import numpy as np
+
+WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+
+@dataclass
+class MediaColumns:
+    """Columnar view of a target's medias, ordered from oldest to newest."""
+    ids: np.ndarray
+    taken_at: np.ndarray
+    media_type: np.ndarray
+    like_count: np.ndarray
+    comment_count: np.ndarray
+
+    @classmethod
+    def from_medias(cls, medias: Iterable[dict[str, Any]]) -> MediaColumns:
+        rows = [(
+            media["id"],
+            to_timestamp(media["taken_at"]),
+            media["media_type"],
+            media.get("like_count") or 0,
+            media.get("comment_count") or 0
+        ) for media in medias]
+        columns = list(zip(*rows)) or [(), (), (), (), ()]
+        order = np.argsort(np.array(columns[1], dtype=np.int64), kind="stable")
+        return cls(
+            np.array(columns[0], dtype=object)[order],
+            np.array(columns[1], dtype=np.int64)[order],
+            np.array(columns[2], dtype=np.int8)[order],
+            np.array(columns[3], dtype=np.float64)[order],
+            np.array(columns[4], dtype=np.float64)[order]
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+def engagement_rate(columns: MediaColumns, follower_count: int) -> np.ndarray:
+    """(likes + comments) / followers per post, in percent."""
+    if not follower_count:
+        return np.full(len(columns), np.nan)
+    return (columns.like_count + columns.comment_count) / follower_count * 100
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """Mean of the last `window` values, shorter at the start."""
+    sums = np.cumsum(np.insert(values, 0, 0))
+    idxs = np.arange(1, len(values) + 1)
+    starts = np.maximum(idxs - window, 0)
+    return (sums[idxs] - sums[starts]) / (idxs - starts)
+
+
+def ewma(values: np.ndarray, alpha: float) -> np.ndarray:
+    """Exponentially weighted moving average, computed as a scaled cumulative sum."""
+    if not len(values):
+        return values
+    # Weights (1 - alpha)^-i are rescaled per block of 256 values to stay within float range
+    result = np.empty(len(values))
+    last = values[0]
+    for start in range(0, len(values), 256):
+        block = values[start:start + 256]
+        decay = (1 - alpha) ** np.arange(1, len(block) + 1)
+        weighted = np.cumsum(alpha * block / decay)
+        result[start:start + len(block)] = decay * (last + weighted)
+        last = result[start + len(block) - 1]
+    return result
+
+
+def outliers(values: np.ndarray, threshold: float = 3.5) -> np.ndarray:
+    """Mask of values far from the median, using the modified z-score on log scaled values."""
+    logs = np.log1p(values)
+    median = np.median(logs) if len(logs) else 0
+    mad = np.median(np.abs(logs - median)) if len(logs) else 0
+    if not mad:
+        return np.zeros(len(values), dtype=bool)
+    return np.abs(0.6745 * (logs - median) / mad) > threshold
+
+
+def hour_histogram(columns: MediaColumns) -> np.ndarray:
+    return np.bincount(columns.taken_at // 3600 % 24, minlength=24)
+
+
+def weekday_histogram(columns: MediaColumns) -> np.ndarray:
+    # 1970-01-01 was a Thursday
+    return np.bincount((columns.taken_at // 86400 + 3) % 7, minlength=7)
+
+
+def trend(columns: MediaColumns, values: np.ndarray) -> float:
+    """Slope of a linear fit of `values` over time, per 30 days."""
+    if len(columns) < 2 or columns.taken_at[0] == columns.taken_at[-1]:
+        return 0.0
+    days = (columns.taken_at - columns.taken_at[0]) / 86400
+    return float(np.polyfit(days, values, 1)[0] * 30)
+
+
+def to_timestamp(value: datetime | str | int) -> int:
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    if isinstance(value, str):
+        return int(datetime.fromisoformat(value).timestamp())
+    return int(value)
@@ -0,0 +1,99 @@
+from __future__ import annotations
+import copy
+import http.cookiejar
+import json
+import os
+import threading
+from typing import Any
+
+import instagrapi
+
+# Session state kept as client attributes rather than cookies, updated from response headers
+SESSION_ATTRIBUTES = ("mid", "ig_u_rur", "ig_www_claim")
+
+
+class ClientPool:
+    """One instagrapi client per thread, all sharing the session of the main thread's client.
+
+    instagrapi clients keep per-request state (last response, headers, cookies) and one
+    requests session each, so sharing one between worker threads serializes them on its
+    connection pool and can mix up their state. Worker threads get a clone built from the
+    main client's settings instead, with its own connection pool. `sync` merges the cookies
+    the clones received back into the main client, saves the settings and hands the merged
+    session back to the clones.
+
+    Only values a clone changed since it was created or last synced are merged, so a clone
+    that sat idle can't overwrite a newer csrftoken or rur with the stale one it started with.
+    """
+
+    def __init__(self, main: instagrapi.Client) -> None:
+        self.main = main
+        self.local = threading.local()
+        # Worker thread, its clone and the session values the clone last got from the main client
+        self.clients: list[tuple[threading.Thread, instagrapi.Client, dict[str, Any]]] = []
+        self._lock = threading.Lock()
+
+    def get(self) -> instagrapi.Client:
+        if threading.current_thread() is threading.main_thread():
+            return self.main
+        if (client := getattr(self.local, "client", None)) is None:
+            client = self.local.client = self.clone()
+        return client
+
+    def clone(self) -> instagrapi.Client:
+        """A new clone of the main client, synced until the current thread finishes or it is released."""
+        with self._lock:
+            settings = copy.deepcopy(self.main.get_settings())
+        client = instagrapi.Client(settings)
+        client.username = self.main.username
+        with self._lock:
+            self.clients.append((threading.current_thread(), client, self._session(client)))
+        return client
+
+    def release(self, client: instagrapi.Client) -> None:
+        """Merge what a clone changed into the main client and stop syncing it."""
+        with self._lock:
+            for entry in [entry for entry in self.clients if entry[1] is client]:
+                self._merge(*entry[1:])
+                self.clients.remove(entry)
+
+    def sync(self, settings_path: str) -> None:
+        """Merge what the clones changed into the main client, save its settings and refresh the clones."""
+        with self._lock:
+            for _, client, base in self.clients:
+                self._merge(client, base)
+
+            self.clients = [(thread, client, base) for thread, client, base in self.clients if thread.is_alive()]
+            for idx, (thread, client, _) in enumerate(self.clients):
+                for cookie in self.main.private.cookies:
+                    self._set_cookie(client, cookie)
+                for name in SESSION_ATTRIBUTES:
+                    setattr(client, name, getattr(self.main, name))
+                self.clients[idx] = (thread, client, self._session(client))
+
+            with open(f"{settings_path}.tmp", "w") as f:
+                json.dump(self.main.get_settings(), f)
+            os.replace(f"{settings_path}.tmp", settings_path)
+
+    def _merge(self, client: instagrapi.Client, base: dict[str, Any]) -> None:
+        for cookie in client.private.cookies:
+            if base["cookies"].get(cookie.name) != cookie.value:
+                self._set_cookie(self.main, cookie)
+        for name in SESSION_ATTRIBUTES:
+            if (value := getattr(client, name)) and value != base[name]:
+                setattr(self.main, name, value)
+
+    @staticmethod
+    def _set_cookie(client: instagrapi.Client, cookie: http.cookiejar.Cookie) -> None:
+        # Cookies loaded from the settings have no domain, the ones of responses do, keep one of each name
+        jar = client.private.cookies
+        for other in [other for other in jar if other.name == cookie.name]:
+            jar.clear(other.domain, other.path, other.name)
+        jar.set_cookie(copy.copy(cookie))
+
+    @staticmethod
+    def _session(client: instagrapi.Client) -> dict[str, Any]:
+        return {
+            "cookies": {cookie.name: cookie.value for cookie in client.private.cookies},
+            **{name: getattr(client, name) for name in SESSION_ATTRIBUTES}
+        }
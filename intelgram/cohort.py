@@ -0,0 +1,48 @@
+from __future__ import annotations
+from typing import Iterable
+
+import numpy as np
+
+# Rows of the incidence matrix multiplied at once, bounds memory to CHUNK_SIZE * targets floats
+CHUNK_SIZE = 1 << 18
+
+
+def pk_array(pks: Iterable[int | str]) -> np.ndarray:
+    """Sorted unique pks as an unsigned 64 bit array."""
+    return np.unique(np.fromiter((int(pk) for pk in pks), dtype=np.uint64))
+
+
+def overlap_matrix(audiences: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    """Intersection sizes and Jaccard indexes of every pair of pk arrays.
+
+    All pks are mapped to dense ids and the users in at least two audiences form a
+    users x audiences incidence matrix, so every intersection size comes out of one
+    matrix product M.T @ M instead of N * N separate set intersections.
+    """
+    sizes = np.array([len(pks) for pks in audiences], dtype=np.int64)
+    intersections = np.diag(sizes).astype(np.float64)
+
+    if len(audiences) > 1 and sizes.sum():
+        labels = np.repeat(np.arange(len(audiences)), sizes)
+        _, ids, counts = np.unique(np.concatenate(audiences), return_inverse=True, return_counts=True)
+
+        # Users that follow a single target only count towards the diagonal
+        shared = counts[ids] > 1
+        labels = labels[shared]
+        ids = np.unique(ids[shared], return_inverse=True)[1]
+        intersections[:] = 0
+
+        order = np.argsort(ids, kind="stable")
+        ids, labels = ids[order], labels[order]
+        for start in range(0, int(ids.max(initial=-1)) + 1, CHUNK_SIZE):
+            lo, hi = np.searchsorted(ids, [start, start + CHUNK_SIZE])
+            matrix = np.zeros((min(CHUNK_SIZE, int(ids[hi - 1]) - start + 1), len(audiences)), dtype=np.float32)
+            matrix[ids[lo:hi] - start, labels[lo:hi]] = 1
+            intersections += matrix.T @ matrix
+        np.fill_diagonal(intersections, sizes)
+
+    intersections = intersections.round().astype(np.int64)
+    unions = sizes[:, None] + sizes[None, :] - intersections
+    with np.errstate(divide="ignore", invalid="ignore"):
+        jaccard = np.where(unions > 0, intersections / unions, 0.0)
+    return intersections, jaccard
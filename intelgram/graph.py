@@ -0,0 +1,140 @@
+from __future__ import annotations
+from array import array
+import os
+from typing import Callable
+
+from intelgram.pks import PkSet, read_pks
+from intelgram.scheduler import Scheduler, TaskError
+from intelgram.state import StateStore
+
+
+class GraphCrawler:
+    """Bounded breadth-first crawl over follow edges.
+
+    Edges are appended to `edges_path` as (source, target) pairs of unsigned 64 bit ints
+    while the crawl runs. Visited pks and frontiers are kept as compact pk arrays, and
+    everything needed to resume is checkpointed to the state directory after every chunk.
+    Users whose followings failed to fetch with a transient error are kept too. A level with
+    failed users isn't finished, and resuming the crawl fetches them again before going on.
+    """
+
+    CHUNK_SIZE = 50
+
+    def __init__(self, scheduler: Scheduler, state: StateStore, name: str, edges_path: str,
+            fetch: Callable[[int, int], list[int]], family: str) -> None:
+        self.scheduler = scheduler
+        self.state = state
+        self.name = name
+        self.edges_path = edges_path
+        self.fetch = fetch
+        self.family = family
+        self.errors: list[TaskError] = []
+        self.cancelled = False
+
+    @property
+    def edge_count(self) -> int:
+        return os.path.getsize(self.edges_path) // 16 if os.path.isfile(self.edges_path) else 0
+
+    def run(self, seeds: list[int], max_depth: int, fanout: int, level_limit: int,
+            progress: Callable[[int, int, int, int], None] | None = None) -> bool:
+        """Crawl from `seeds`, returns True when the crawl is complete.
+
+        `fanout` caps the edges fetched per user and `level_limit` the users expanded per depth level
+        (0 means no limit). An unfinished crawl with the same parameters is resumed. A crawl with
+        failed users stops at the end of their level.
+        """
+        options = {"seeds": seeds, "max_depth": max_depth, "fanout": fanout, "level_limit": level_limit}
+        meta = self.state.load(self.name)
+        if meta and meta["options"] == options and not meta["finished"]:
+            visited = PkSet.load(self.state.file(f"{self.name}_visited.pks"))
+            self._truncate(self.edges_path, meta["edges_size"])
+        else:
+            meta = {"options": options, "depth": 0, "position": 0, "edges_size": 0, "next_size": 0, "failed": [], "finished": False}
+            visited = PkSet(seeds)
+            self._truncate(self.edges_path, 0)
+            self._write_frontier(0, array("Q", seeds))
+            self._checkpoint(meta, visited)
+
+        while meta["depth"] < max_depth:
+            depth = meta["depth"]
+            frontier = read_pks(self._frontier_path(depth))
+            if level_limit:
+                frontier = frontier[:level_limit]
+            if not frontier:
+                break
+            next_path = self._frontier_path(depth + 1)
+            self._truncate(next_path, meta["next_size"])
+
+            # Users that failed in an earlier run of this level go first
+            retried = meta.get("failed", [])
+            failed = []
+            while retried or meta["position"] < len(frontier):
+                if retried:
+                    chunk, retried = retried[:self.CHUNK_SIZE], retried[self.CHUNK_SIZE:]
+                else:
+                    chunk = frontier[meta["position"]:meta["position"] + self.CHUNK_SIZE]
+                    meta["position"] += len(chunk)
+                batch = self.scheduler.map(lambda pk: (pk, self.fetch(pk, fanout)), chunk, self.family)
+
+                with open(self.edges_path, "ab") as edges_file, open(next_path, "ab") as next_file:
+                    try:
+                        for _, _, (source, targets) in batch:
+                            edges = array("Q")
+                            new = array("Q")
+                            for target in targets:
+                                edges.extend((source, target))
+                                if visited.add(target):
+                                    new.append(target)
+                            edges.tofile(edges_file)
+                            new.tofile(next_file)
+                    except KeyboardInterrupt:
+                        batch.cancelled = True
+
+                self.errors.extend(batch.errors)
+                if batch.cancelled:
+                    # The next run resumes from the last checkpoint, dropping this partial chunk
+                    self.cancelled = True
+                    return False
+
+                failed.extend(error.item for error in batch.errors if self.scheduler.is_transient(error.exception))
+                meta["failed"] = retried + failed
+                meta["edges_size"] = os.path.getsize(self.edges_path)
+                meta["next_size"] = os.path.getsize(next_path)
+                self._checkpoint(meta, visited)
+
+                if progress:
+                    progress(depth, meta["position"], len(frontier), self.edge_count)
+
+            if meta.get("failed"):
+                # Finished the level except for failed users, the next run retries them
+                return False
+            meta.update({"depth": depth + 1, "position": 0, "next_size": 0})
+            self._checkpoint(meta, visited)
+            os.remove(self._frontier_path(depth))
+
+        meta["finished"] = True
+        self._checkpoint(meta, visited)
+        return True
+
+    def export_csv(self, path: str) -> None:
+        with open(self.edges_path, "rb") as edges_file, open(path, "w") as f:
+            f.write("source,target\n")
+            while chunk := edges_file.read(16 * 65536):
+                edges = array("Q", chunk)
+                f.writelines(f"{edges[idx]},{edges[idx + 1]}\n" for idx in range(0, len(edges), 2))
+
+    def _checkpoint(self, meta: dict, visited: PkSet) -> None:
+        visited.save(self.state.file(f"{self.name}_visited.pks"))
+        self.state.save(self.name, meta)
+
+    def _frontier_path(self, depth: int) -> str:
+        return self.state.file(f"{self.name}_frontier_{depth}.pks")
+
+    def _write_frontier(self, depth: int, pks: array) -> None:
+        with open(self._frontier_path(depth), "wb") as f:
+            pks.tofile(f)
+
+    @staticmethod
+    def _truncate(path: str, size: int) -> None:
+        with open(path, "ab") as f:
+            f.truncate(size)
@@ -1,17 +1,32 @@
 from __future__ import annotations
-import concurrent.futures
+import copy
+import hashlib
 import json
 import os
+import random
 import re
+import shutil
+import sqlite3
 import sys
+import threading
 import time
-from typing import Any
+from typing import Any, Callable, Iterable, Iterator
+import urllib.error
+import urllib.parse
 import urllib.request
 
+import geopy.exc
 import geopy.geocoders
+import numpy as np
 import instagrapi
 from instagrapi.exceptions import (
+    ClientConnectionError,
     ClientError,
+    ClientIncompleteReadError,
+    ClientRequestTimeout,
+    ClientThrottledError,
+    PleaseWaitFewMinutes,
+    RateLimitError,
     TwoFactorRequired,
     UnknownError,
     UserNotFound
@@ -19,25 +34,99 @@ from instagrapi.exceptions import (
 from inteltk import calculate_remaining_time
 from inteltk.colors import *
 import prettytable
+import requests
 
+from intelgram import analytics, cohort, output
+from intelgram.clients import ClientPool
+from intelgram.graph import GraphCrawler
 from intelgram.logger import setup_logger
+from intelgram.media_index import IMAGE_EXTENSIONS, VIDEO_EXTENSIONS, MediaIndex
+from intelgram.pks import PkSet
+from intelgram.prefetch import Prefetcher
+from intelgram.scheduler import Batch, Feed, Scheduler
+from intelgram.search import SearchIndex
+from intelgram.server import JobQueue, JobServer
+from intelgram.snapshots import SnapshotStore, merge_pks
+from intelgram.state import StateStore
+from intelgram.thumbnails import Thumbnails
+from intelgram.userlist import UserList
+
+
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+USER_PAGE_SIZE = 200
+THREAD_LIMITS = {
+    "default": DEFAULT_WORKERS,
+    "comments": 4,
+    "download": DEFAULT_WORKERS,
+    "follows": 2,
+    "hashtags": DEFAULT_WORKERS,
+    "highlights": DEFAULT_WORKERS,
+    "likers": 4,
+    "locations": DEFAULT_WORKERS,
+    "prefetch": 1,
+    "stories": 2,
+    "user_info": 4
+}
+# Weight of one interaction of each kind when ranking interactors, keyed by output file suffix
+INTERACTION_WEIGHTS = {
+    "comments": 3,
+    "likers": 1,
+    "tagged": 2,
+    "tagged-target": 4,
+    "tagged-with": 1
+}
+# Public methods that can't run as a job in serve mode
+SERVE_EXCLUDED = ("parse_extra_input", "parse_info_list", "serve", "target", "watch")
+SERVE_WORKERS = 4
+# Minimum seconds between two requests of the same family
+THREAD_INTERVALS = {
+    "follows": 1.0,
+    "prefetch": 1.0,
+    "stories": 2.0
+}
+# Errors worth retrying, anything else (missing users or posts, bad data) fails the same way every time
+TRANSIENT_ERRORS = (
+    ClientConnectionError,
+    ClientIncompleteReadError,
+    ClientRequestTimeout,
+    ClientThrottledError,
+    PleaseWaitFewMinutes,
+    RateLimitError,
+    ConnectionError,
+    TimeoutError,
+    requests.ConnectionError,
+    requests.Timeout,
+    geopy.exc.GeocoderRateLimited,
+    geopy.exc.GeocoderTimedOut,
+    geopy.exc.GeocoderUnavailable
+)
 
 
 class Intelgram:
-    def __init__(self, name: str, command: list[str], extra_input: list[str], interactive: bool,
-            json: bool, output: str, style: str, txt: bool, verification_code: str) -> None:
+    def __init__(self, name: str, command: list[str], extra_input: list[str], output_format: str, interactive: bool,
+            json: bool, output: str, prefetch: bool, style: str, txt: bool, update: bool, verification_code: str) -> None:
         setup_logger()
         
-        self.client = instagrapi.Client()
+        self.clients = ClientPool(instagrapi.Client())
+        self.scheduler = Scheduler(THREAD_LIMITS, THREAD_INTERVALS, transient=self._is_transient)
         
         self.target_name = name
         self.extra_input = extra_input
         self.interactive = interactive or not command
         self.json = json
+        self.output_format = output_format or "json"
         self.txt = txt
+        self.update = update
         self.table_style = eval(f"prettytable.{style}") if style else prettytable.DEFAULT
-        self.output = output or "output"
+        # Normalised, so paths built from it compare equal whatever form -o was given in
+        self.output = os.path.normpath(output or "output")
         os.makedirs(self.output, exist_ok=True)
+        self.state = StateStore(f"{self.output}/.state")
+        self.written = []
+        self.target_ids = {}
+        self.search_index = None
+        self.snapshots = None
+        self.prefetcher = None
         self.verification_code = verification_code
 
         self.credentials_path = "config/credentials.json"
@@ -47,6 +136,25 @@ class Intelgram:
         self._login()
         printcolor(f"Logged in as {WHITE}{self.client.username} {BLUE}[{self.client.user_id}]", GREEN)
         self._print_target()
+        self.prefetch = prefetch
+
+    @property
+    def client(self) -> instagrapi.Client:
+        """The logged-in client of the current thread."""
+        return self.clients.get()
+
+    @property
+    def prefetch(self) -> bool:
+        return self.prefetcher is not None
+
+    @prefetch.setter
+    def prefetch(self, enabled: bool) -> None:
+        if enabled and not self.prefetcher:
+            self.prefetcher = Prefetcher(self.scheduler, done=lambda: self.clients.sync(self.settings_path))
+            self._start_prefetch()
+        elif not enabled and self.prefetcher:
+            self.prefetcher.cancel()
+            self.prefetcher = None
 
     def captions(self) -> None:
         captions = self._get_captions()
@@ -63,11 +171,53 @@ class Intelgram:
         print(table.get_string())
         printcolor(f"Found {len(captions)} captions", GREEN)
 
+        self._get_search_index().add(
+            (f"caption:{caption['id']}", "caption", self.target_name, caption["id"], None, caption["taken_at"], caption["caption"])
+            for caption in captions
+        )
+
         data = [dict(caption.items()) for caption in captions]
         self._save_to_files(data, table, "captions")
         
+    def cohort_overlap(self) -> None:
+        if len(targets := list(dict.fromkeys(self._get_usernames("Usernames of the cohort")))) < 2:
+            printcolor("At least two usernames are needed!", RED)
+            return
+
+        audiences = dict(self._run_threaded(self._get_follower_pks, targets, "follows", "Getting followers of user"))
+        if len(targets := [username for username in targets if username in audiences]) < 2:
+            printcolor("Not enough follower lists to compare", RED)
+            return
+
+        intersections, jaccard = cohort.overlap_matrix([audiences[username] for username in targets])
+
+        table = prettytable.PrettyTable()
+        table.field_names = ["target", "other", "common_followers", "jaccard"]
+
+        pairs = [(a, b) for a in range(len(targets)) for b in range(a + 1, len(targets))]
+        for a, b in sorted(pairs, key=lambda pair: jaccard[pair], reverse=True):
+            table.add_row([targets[a], targets[b], intersections[a, b], round(float(jaccard[a, b]), 4)])
+
+        print(table.get_string())
+        printcolor(f"Compared {len(targets)} audiences with {sum(map(len, audiences.values()))} followers in total", GREEN)
+
+        filename = f"{self.target_name}_cohort-overlap"
+        with open(f"{self.output}/{filename}.csv", "w") as f:
+            f.write("target,other,common_followers,jaccard\n")
+            f.writelines(f"{targets[a]},{targets[b]},{intersections[a, b]},{jaccard[a, b]:.6f}\n" for a, b in pairs)
+        printcolor(f"Successfully saved {self.target_name} cohort overlap to {filename}.csv", GREEN)
+
+        if self.json:
+            data = {
+                "targets": targets,
+                "followers": np.diag(intersections).tolist(),
+                "intersections": intersections.tolist(),
+                "jaccard": jaccard.round(6).tolist()
+            }
+        self._save_to_files(data, table, "cohort-overlap", "cohort overlap")
+
     def comments(self) -> None:
-        posts = self._get_user_medias()
+        posts = self._iter_user_medias()
 
         table = prettytable.PrettyTable()
         table.field_names = ["id", "comment_pk", "user_pk", "username", "created_at", "like_count", "text"]
@@ -98,8 +248,149 @@ class Intelgram:
         print(table.get_string())
         printcolor(f"Found {post_count} post with comments. Total comments: {comment_count}", GREEN)
 
+        self._get_search_index().add(
+            (f"comment:{comment['pk']}", "comment", self.target_name, post[0], comment["user"]["pk"],
+                analytics.to_timestamp(comment["created_at_utc"]), comment["text"])
+            for post in comments for comment in post[1]
+        )
+
         self._save_to_files(data, table, "comments")
 
+    def engagement(self) -> None:
+        if not (user_input := self.parse_extra_input()) and self.interactive:
+            user_input = inputcolor("Usernames (comma separated, empty for target): ", CYAN)
+        targets = [username for username in user_input.replace(" ", "").split(",") if username] or [self.target_name]
+
+        if not (offline := self.parse_extra_input()) and self.interactive:
+            offline = inputcolor("Use saved posts-data files when they exist (y/n) [n]: ", CYAN)
+
+        table = prettytable.PrettyTable()
+        table.field_names = ["target", "posts", "followers", "avg_er_%", "median_likes", "ewma_likes", "likes_trend_30d", "outliers", "top_hour", "top_weekday"]
+
+        if self.json:
+            data = {}
+
+        for idx, username in enumerate(targets):
+            printcolor(f"Analysing {username} ({idx + 1} of {len(targets)})", BLUE, end="\033[K\r")
+            try:
+                medias, follower_count = self._get_engagement_data(username, offline.lower() == "y")
+            except Exception as e:
+                printcolor(f"{YELLOW}{username}{RESET} generated an exception: {e}", RED)
+                continue
+
+            if not len(columns := analytics.MediaColumns.from_medias(medias)):
+                continue
+
+            rates = analytics.engagement_rate(columns, follower_count)
+            rolling = analytics.rolling_mean(columns.like_count, 10)
+            ewma = analytics.ewma(columns.like_count, 0.2)
+            outliers = analytics.outliers(columns.like_count)
+            hours = analytics.hour_histogram(columns)
+            weekdays = analytics.weekday_histogram(columns)
+            trend = analytics.trend(columns, columns.like_count)
+
+            summary = {
+                "posts": len(columns),
+                "followers": follower_count,
+                "avg_er_%": None if np.isnan(rates).all() else round(float(np.nanmean(rates)), 3),
+                "median_likes": float(np.median(columns.like_count)),
+                "ewma_likes": round(float(ewma[-1]), 1),
+                "likes_trend_30d": round(trend, 1),
+                "outliers": int(outliers.sum()),
+                "top_hour": int(hours.argmax()),
+                "top_weekday": analytics.WEEKDAYS[weekdays.argmax()]
+            }
+            table.add_row([username, *summary.values()])
+
+            if self.json:
+                data[username] = {
+                    "summary": summary,
+                    "hours": hours.tolist(),
+                    "weekdays": dict(zip(analytics.WEEKDAYS, weekdays.tolist())),
+                    "posts": {
+                        columns.ids[post_idx]: {
+                            "taken_at": int(columns.taken_at[post_idx]),
+                            "like_count": int(columns.like_count[post_idx]),
+                            "comment_count": int(columns.comment_count[post_idx]),
+                            "engagement_rate": None if np.isnan(rates[post_idx]) else round(float(rates[post_idx]), 4),
+                            "rolling_likes": round(float(rolling[post_idx]), 1),
+                            "ewma_likes": round(float(ewma[post_idx]), 1),
+                            "outlier": bool(outliers[post_idx])
+                        } for post_idx in range(len(columns))
+                    }
+                }
+        print()
+
+        if not table.rows:
+            printcolor("No posts found", RED)
+            return
+
+        print(table.get_string())
+        printcolor(f"Analysed {len(table.rows)} targets", GREEN)
+
+        self._save_to_files(data, table, "engagement")
+
+    def follower_diff(self) -> None:
+        if not (kind := self.parse_extra_input()) and self.interactive:
+            kind = inputcolor("Followers or followings [followers]: ", CYAN)
+        if (kind := kind or "followers") not in ("followers", "followings"):
+            printcolor(f"Invalid list: {kind}", RED)
+            return
+
+        snapshots = self._get_snapshots()
+        if len(history := snapshots.list(self.target_id, kind)) < 2:
+            printcolor(f"Not enough {kind} snapshots, every {kind} run of target records one", RED)
+            return
+
+        if self.interactive:
+            table = prettytable.PrettyTable()
+            table.field_names = ["id", "created", "last_checked", "count", "gained", "lost"]
+            for snapshot in history:
+                table.add_row([
+                    snapshot["id"],
+                    time.strftime("%Y-%m-%d %H:%M", time.localtime(snapshot["created"])),
+                    time.strftime("%Y-%m-%d %H:%M", time.localtime(snapshot["checked"])),
+                    snapshot["count"],
+                    "" if snapshot["full"] else snapshot["added"],
+                    "" if snapshot["full"] else snapshot["removed"]
+                ])
+            print(table.get_string())
+
+        ids = []
+        for prompt, default in [("Old snapshot id", history[-2]["id"]), ("New snapshot id", history[-1]["id"])]:
+            if not (user_input := self.parse_extra_input()) and self.interactive:
+                user_input = inputcolor(f"{prompt} [{default}]: ", CYAN)
+            try:
+                ids.append(int(user_input) if user_input else default)
+            except ValueError:
+                printcolor("Invalid number", RED)
+                return
+        if not all(id in {snapshot["id"] for snapshot in history} for id in ids):
+            printcolor(f"Unknown {kind} snapshot id, choose from the ids of target's snapshots", RED)
+            return
+
+        lost, gained, _ = merge_pks(snapshots.pks(ids[0]), snapshots.pks(ids[1]))
+        users = snapshots.users(np.concatenate([gained, lost]))
+
+        table = prettytable.PrettyTable()
+        table.field_names = ["change", "pk", "username", "full_name"]
+
+        if self.json:
+            data = {"gained": [], "lost": []}
+
+        for change, pks in [("gained", gained), ("lost", lost)]:
+            for pk in pks.tolist():
+                username, full_name = users.get(pk, ("", ""))
+                table.add_row([change, pk, username, full_name])
+
+                if self.json:
+                    data[change].append({"pk": str(pk), "username": username, "full_name": full_name})
+
+        print(table.get_string())
+        printcolor(f"Gained {len(gained)} and lost {len(lost)} {kind} between snapshots {ids[0]} and {ids[1]}", GREEN)
+
+        self._save_to_files(data, table, f"{kind}-diff_{ids[0]}-{ids[1]}", f"{kind} diff")
+
     def followers(self) -> None:
         followers = self._get_user_followers()
 
@@ -107,14 +398,12 @@ class Intelgram:
         table.field_names = ["pk", "username", "full_name"]
 
         if self.json:
-            data = []
+            # Written straight from the UserList, without a list of dicts in between
+            data = followers
 
         for user in followers:
             table.add_row([user["pk"], user["username"], user["full_name"]])
 
-            if self.json:
-                data.append(user)
-
         print(table.get_string())
         printcolor(f"Found {len(followers)} followers", GREEN)
 
@@ -135,7 +424,7 @@ class Intelgram:
             printcolor(f"Error: {e.message}", RED)
             return
         
-        followers2 = self._get_user_followers(target2_id)
+        followers2 = self._get_user_followers(target2_id, target2)
 
         table = prettytable.PrettyTable()
         table.field_names = ["pk", "username", "full_name"]
@@ -162,14 +451,12 @@ class Intelgram:
         table.field_names = ["pk", "username", "full_name"]
 
         if self.json:
-            data = []
+            # Written straight from the UserList, without a list of dicts in between
+            data = followings
 
         for user in followings:
             table.add_row([user["pk"], user["username"], user["full_name"]])
 
-            if self.json:
-                data.append(user)
-
         print(table.get_string())
         printcolor(f"Found {len(followings)} followings", GREEN)
 
@@ -190,7 +477,7 @@ class Intelgram:
             printcolor(f"Error: {e.message}", RED)
             return
         
-        followings2 = self._get_user_followings(target2_id)
+        followings2 = self._get_user_followings(target2_id, target2)
 
         table = prettytable.PrettyTable()
         table.field_names = ["pk", "username", "full_name"]
@@ -210,6 +497,50 @@ class Intelgram:
 
         self._save_to_files(data, table, f"followings-subset_{target2}", f"and {target2} followings subset")
         
+    def graph_crawl(self) -> None:
+        if not (seed_names := self.parse_extra_input()) and self.interactive:
+            seed_names = inputcolor("Seed usernames (comma separated, empty for target): ", CYAN)
+
+        try:
+            seeds = [int(self.client.user_id_from_username(name)) for name in seed_names.replace(" ", "").split(",")] if seed_names else [int(self.target_id)]
+        except UserNotFound as e:
+            printcolor(f"Error: {e.message}", RED)
+            return
+
+        options = []
+        for prompt, default in [("Depth", 2), ("Max followings per user (0 for all)", 200), ("Max users per level (0 for all)", 1000)]:
+            if not (user_input := self.parse_extra_input()) and self.interactive:
+                user_input = inputcolor(f"{prompt} [{default}]: ", CYAN)
+            try:
+                options.append(int(user_input) if user_input else default)
+            except ValueError:
+                printcolor("Invalid number", RED)
+                return
+        depth, fanout, level_limit = options
+
+        name = f"{self.target_name}_graph-crawl"
+        crawler = GraphCrawler(self.scheduler, self.state, name, f"{self.output}/{name}_edges.bin", self._get_following_pks, "follows")
+
+        def progress(level: int, position: int, total: int, edges: int) -> None:
+            printcolor(f"Depth {level + 1} of {depth}: expanded {position} of {total} users. Edges: {edges}", BLUE, end="\033[K\r")
+
+        finished = crawler.run(seeds, depth, fanout, level_limit, progress)
+        self.clients.sync(self.settings_path)
+        print()
+        for error in crawler.errors:
+            printcolor(f"{YELLOW}{error.family} {error.item}{RESET} generated an exception: {error.exception}", RED)
+
+        if not finished and not crawler.cancelled:
+            printcolor(f"Crawl stopped with {crawler.edge_count} edges because of failed users, run graph-crawl again with the same inputs to retry them and resume", YELLOW)
+            return
+        if not finished:
+            printcolor(f"Crawl interrupted with {crawler.edge_count} edges, run graph-crawl again with the same inputs to resume", YELLOW)
+            return
+
+        crawler.export_csv(f"{self.output}/{name}_edges.csv")
+        printcolor(f"Found {crawler.edge_count} edges", GREEN)
+        printcolor(f"Successfully saved {self.target_name} graph crawl to {name}_edges.bin and {name}_edges.csv", GREEN)
+
     def hashtags(self) -> None:
         captions = self._get_captions()
 
@@ -219,21 +550,8 @@ class Intelgram:
         if self.json:
             data = {}
 
-        hashtag_posts = []
-        start_time = time.time()
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = [executor.submit(self._get_hashtag_data, caption) for caption in captions]
-            for idx, future in enumerate(futures):
-                remaining_time = calculate_remaining_time(start_time, idx, len(captions))
-                printcolor(f"Checking post {idx + 1} of {len(captions)}. Remaining time: {remaining_time}", BLUE, end="\033[K\r")
-                try:
-                    result = future.result()
-                except Exception as e:
-                    printcolor(f"{YELLOW}{repr(future)}{RESET} generated an exception: {e}", RED)
-                else:
-                    if result:
-                        hashtag_posts.append(result)
-        print()
+        results = self._run_threaded(self._get_hashtag_data, captions, "hashtags", "Checking post")
+        hashtag_posts = [result for result in results if result]
 
         post_count = 0
         hashtag_count = 0
@@ -281,9 +599,8 @@ class Intelgram:
                 printcolor(f"{k}: {WHITE}{v}", BLUE)
 
         if self.json:
-            filename = f"{user_info['username']}_info"
-            self._write_json(user_info, filename)
-            printcolor(f"Successfully saved {self.target_name} info to {filename}.json", GREEN)
+            filename = self._write_json(user_info, f"{user_info['username']}_info")
+            printcolor(f"Successfully saved {self.target_name} info to {filename}", GREEN)
 
     def info_list(self) -> None:
         if not self.json:
@@ -294,17 +611,10 @@ class Intelgram:
             "For now these requests are made through the mobile api which has a much lower rate limit.\n"
             "Please use this function lightly to avoid being blocked by instagram.", YELLOW)
 
-        if not (filename := self.parse_extra_input()) and self.interactive:
-            filename = inputcolor("Filename (relative to the output dir): ", CYAN)
-        
-        valid_names = ["_comments.json", "_followers.json", "_followers-subset.json", "_followings.json", "_followings-subset.json",
-            "_likers.json", "_tagged.json", "_tagged-target.json", "_tagged-with.json"]
-        if not (os.path.isfile(f"{self.output}/{filename}") and re.findall("|".join(valid_names), filename)):
-            printcolor(f"No valid file exists with the name: {filename}", RED)
+        if not (filename := self._get_user_list_file()):
             return
 
-        with open(f"{self.output}/{filename}") as f:
-            data = json.load(f)
+        data = output.load(f"{self.output}/{filename}")
 
         if (user_dicts := self.parse_info_list(data)) is None:
             printcolor("Invalid file structure", RED)
@@ -330,9 +640,51 @@ class Intelgram:
 
         printcolor(f"Collected {len(users)} user info", GREEN)
         
-        output_filename = f"{filename.replace('.json', '')}_{min_idx}_{max_idx}_info"
-        self._write_json(users, output_filename)
-        printcolor(f"Successfully saved {self.target_name} followers info to {output_filename}.json", GREEN)
+        output_filename = self._write_json(users, f"{output.strip_extension(filename)}_{min_idx}_{max_idx}_info")
+        printcolor(f"Successfully saved {self.target_name} followers info to {output_filename}", GREEN)
+
+    def interactions(self) -> None:
+        counts, users, missing = self._count_interactions()
+        if missing:
+            printcolor(f"No saved output for: {', '.join(missing)}. Run these commands with JSON output to include them", YELLOW)
+        if not counts:
+            printcolor("No interactions found", RED)
+            return
+
+        if not (user_input := self.parse_extra_input()) and self.interactive:
+            user_input = inputcolor("Number of top users [50]: ", CYAN)
+        try:
+            limit = int(user_input) if user_input else 50
+        except ValueError:
+            printcolor("Invalid number", RED)
+            return
+
+        kinds = list(INTERACTION_WEIGHTS)
+        scores = {pk: sum(INTERACTION_WEIGHTS[kind] * count for kind, count in zip(kinds, user_counts)) for pk, user_counts in counts.items()}
+        top = sorted(scores, key=scores.get, reverse=True)[:limit]
+
+        if not (enrich := self.parse_extra_input()) and self.interactive:
+            enrich = inputcolor("Get user info of the top users (y/n) [n]: ", CYAN)
+        infos = {}
+        if enrich.lower() == "y":
+            infos = {info["pk"]: info for info in self._get_user_info_gql_threaded(top)}
+
+        table = prettytable.PrettyTable()
+        table.field_names = ["rank", "pk", "username", "full_name", "score", *kinds]
+
+        if self.json:
+            data = []
+
+        for rank, pk in enumerate(top, 1):
+            table.add_row([rank, pk, users[pk]["username"], users[pk]["full_name"], scores[pk], *counts[pk]])
+
+            if self.json:
+                data.append({"rank": rank, **users[pk], "score": scores[pk], **dict(zip(kinds, counts[pk])), "info": infos.get(pk)})
+
+        print(table.get_string())
+        printcolor(f"Found {len(counts)} interacting users", GREEN)
+
+        self._save_to_files(data, table, "interactions")
 
     def likes(self) -> None:
         posts = self._get_user_medias()
@@ -375,7 +727,7 @@ class Intelgram:
         self._save_to_files(data, table, "likes")
 
     def likers(self) -> None:
-        posts = self._get_user_medias()
+        posts = self._iter_user_medias()
 
         table = prettytable.PrettyTable()
         table.field_names = ["id", "pk", "username", "full_name"]
@@ -390,7 +742,7 @@ class Intelgram:
             for user in post[1]:
                 table.add_row([post[0], user["pk"], user["username"], user["full_name"]])
             if self.json:
-                data[post[0]] = post[1]
+                data[post[0]] = list(post[1])
             post_count += 1
 
         if post_count == 0:
@@ -403,7 +755,7 @@ class Intelgram:
         self._save_to_files(data, table, "likers")
         
     def locations(self) -> None:
-        posts = self._get_user_medias()
+        posts = self.scheduler.stream(self._iter_user_medias())
 
         table = prettytable.PrettyTable()
         table.field_names = ["id", "taken_at", "loc_pk", "name", "address", "lat", "lng"]
@@ -412,21 +764,8 @@ class Intelgram:
         if self.json:
             data = {}
 
-        location_posts = []
-        start_time = time.time()
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = [executor.submit(self._get_location_data, post) for post in posts]
-            for idx, future in enumerate(futures):
-                remaining_time = calculate_remaining_time(start_time, idx, len(posts))
-                printcolor(f"Checking post {idx + 1} of {len(posts)}. Remaining time: {remaining_time}", BLUE, end="\033[K\r")
-                try:
-                    result = future.result()
-                except Exception as e:
-                    printcolor(f"{YELLOW}{repr(future)}{RESET} generated an exception: {e}", RED)
-                else:
-                    if result:
-                        location_posts.append(result)
-        print()
+        results = self._run_threaded(self._get_location_data, posts, "locations", "Checking post")
+        location_posts = [result for result in results if result]
 
         count = 0
         for post in location_posts:
@@ -469,9 +808,8 @@ class Intelgram:
         
         posts = self._get_user_medias()
 
-        name = f"{self.target_name}_posts-data"
-        self._write_json(posts, name)
-        printcolor(f"Successfully saved {self.target_name} posts data to {name}.json", GREEN)
+        filename = self._write_json(posts, f"{self.target_name}_posts-data")
+        printcolor(f"Successfully saved {self.target_name} posts data to {filename}", GREEN)
 
     def posts_tagged(self) -> None:
         posts = self._get_usertag_medias()
@@ -498,9 +836,8 @@ class Intelgram:
         
         posts = self._get_usertag_medias()
 
-        name = f"{self.target_name}_posts-tagged-data"
-        self._write_json(posts, name)
-        printcolor(f"Successfully saved {self.target_name} posts tagged data to {name}.json", GREEN)
+        filename = self._write_json(posts, f"{self.target_name}_posts-tagged-data")
+        printcolor(f"Successfully saved {self.target_name} posts tagged data to {filename}", GREEN)
 
     def profile_pic(self) -> None:
         user_info = self._get_user_info_v1()
@@ -511,6 +848,209 @@ class Intelgram:
         })
         printcolor(f"Successfully saved {self.target_name} profile pic to {name}", GREEN)
 
+    def profile_pics_list(self) -> None:
+        if not (filename := self._get_user_list_file()):
+            return
+
+        folder = f"{output.strip_extension(filename)}_profile-pics"
+        os.makedirs(f"{self.output}/{folder}", exist_ok=True)
+        os.makedirs(self.state.file("profile-pics"), exist_ok=True)
+        # Last record per user wins, the log only grows when a picture changed
+        manifest = {record["pk"]: record for record in self.state.records("profile-pics")}
+        skipped = {"unchanged": 0, "missing": 0}
+
+        def users() -> Iterator[dict[str, Any]]:
+            seen = PkSet()
+            for user in self._iter_file_users(f"{self.output}/{filename}"):
+                if not seen.add(user["pk"]):
+                    continue
+                if not (url := user.get("profile_pic_url")):
+                    skipped["missing"] += 1
+                    continue
+
+                path = f"{self.output}/{folder}/{user['username']}_{user['pk']}.jpg"
+                if (record := manifest.get(str(user["pk"]))) and record["url"] == urllib.parse.urlsplit(url).path:
+                    if os.path.isfile(blob := self.state.file(f"profile-pics/{record['hash']}.jpg")):
+                        # Unchanged picture, only linked when this list's folder doesn't have it yet
+                        if not os.path.isfile(path):
+                            self._link_profile_pic(blob, path)
+                        skipped["unchanged"] += 1
+                        continue
+                yield {**user, "path": path}
+
+        results = self._run_threaded(self._download_profile_pic, self.scheduler.stream(users()), "download", "Downloading profile pic")
+
+        printcolor(f"Downloaded {len(results)} profile pics ({sum(results)} new images), "
+            f"{skipped['unchanged']} unchanged and {skipped['missing']} without a picture url", GREEN)
+        printcolor(f"Successfully saved {self.target_name} profile pics to {folder}", GREEN)
+
+    def retry(self) -> None:
+        if not (records := list(self.state.records("retry"))):
+            printcolor("No failed items to retry", GREEN)
+            return
+
+        groups = {}
+        for record in records:
+            groups.setdefault((record["target"], record["target_id"], record["func"], record["family"]), []).append(record)
+
+        remaining = []
+        groups = list(groups.items())
+        for group_idx, ((target, target_id, func, family), group) in enumerate(groups):
+            if not self.json and not func.startswith("_download"):
+                # Results of these can only be saved as JSON, fetching them now would lose them
+                printcolor(f"Kept {len(group)} failed {func} items of {target}, enable JSON output to retry them", YELLOW)
+                remaining.extend(group)
+                continue
+
+            printcolor(f"Retrying {len(group)} failed {func} items of {MAGENTA}{target}", BLUE)
+            view = self._view(target, target_id)
+            batch = self.scheduler.map(getattr(view, func), [record["item"] for record in group], family)
+            results = []
+            done = set()
+
+            def handle(idx: int, _, result: Any) -> None:
+                done.add(idx)
+                if result:
+                    results.append(result)
+
+            self._drain(batch, handle, report=False)
+
+            errors = {error.idx: error.exception for error in batch.errors}
+            for idx, record in enumerate(group):
+                if idx in errors:
+                    printcolor(f"{YELLOW}{family} {record['item']}{RESET} generated an exception: {errors[idx]}", RED)
+                    record = {**record, "error": repr(errors[idx]), "time": int(time.time())}
+                    if self._is_transient(errors[idx]):
+                        remaining.append(record)
+                    else:
+                        self.state.append("failed", record)
+                elif idx not in done:
+                    remaining.append(record)
+            printcolor(f"Recovered {len(done)} of {len(group)} items", GREEN)
+
+            if results and not func.startswith("_download"):
+                filename = view._write_json(self._retry_output(results), f"{target}_retry_{func.removeprefix('_get_')}")
+                printcolor(f"Successfully saved {target} recovered items to {filename}", GREEN)
+
+            if batch.cancelled:
+                remaining.extend(record for _, other in groups[group_idx + 1:] for record in other)
+                break
+
+        self.state.replace_records("retry", remaining)
+        self.clients.sync(self.settings_path)
+        if remaining:
+            printcolor(f"{len(remaining)} items still failing, kept them for the next retry", YELLOW)
+
+    def search(self) -> None:
+        if not (query := self.parse_extra_input()) and self.interactive:
+            query = inputcolor("Search query (FTS5 syntax, e.g. \"exact phrase\" or word*): ", CYAN)
+        if not query:
+            printcolor("No search query given!", RED)
+            return
+
+        filters = {}
+        for name, prompt in [("target", "Only results of user"), ("kind", "Only captions or comments (caption/comment)"),
+                ("post_id", "Only results of post id"), ("user_pk", "Only results written by user pk"),
+                ("since", "Only results since (YYYY-MM-DD)"), ("until", "Only results before (YYYY-MM-DD)")]:
+            if not (user_input := self.parse_extra_input()) and self.interactive:
+                user_input = inputcolor(f"{prompt} (empty for all): ", CYAN)
+            filters[name] = user_input or None
+
+        try:
+            for name in ("since", "until"):
+                if filters[name]:
+                    filters[name] = int(time.mktime(time.strptime(filters[name], "%Y-%m-%d")))
+        except ValueError:
+            printcolor("Invalid date, use YYYY-MM-DD", RED)
+            return
+
+        try:
+            results = self._get_search_index().search(query, **filters)
+        except sqlite3.OperationalError as e:
+            printcolor(f"Invalid search query: {e}", RED)
+            return
+
+        if not results:
+            printcolor("No matches found", RED)
+            return
+
+        table = prettytable.PrettyTable()
+        table.field_names = ["kind", "target", "post_id", "user_pk", "created", "snippet"]
+        table.max_width["snippet"] = 60
+        table.add_rows([[*result.values()][:-1] for result in results])
+
+        print(table.get_string())
+        printcolor(f"Found {len(results)} matches", GREEN)
+
+        self._save_to_files(results, table, "search")
+
+    def serve(self) -> None:
+        if not (user_input := self.parse_extra_input()) and self.interactive:
+            user_input = inputcolor("Port [8765]: ", CYAN)
+        try:
+            port = int(user_input) if user_input else 8765
+        except ValueError:
+            printcolor("Invalid port", RED)
+            return
+
+        commands = [name.replace("_", "-") for name in dir(self)
+            if not name.startswith("_") and name not in SERVE_EXCLUDED and callable(getattr(self, name))]
+        server = JobServer(port, JobQueue(self.state.file("jobs.db")), self._run_job, commands, self.output, SERVE_WORKERS)
+
+        printcolor(f"Serving on {WHITE}http://127.0.0.1:{port}{GREEN}, press Ctrl-C to stop", GREEN)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print()
+            printcolor("Stopped serving", GREEN)
+        server.server_close()
+
+    def similar_media(self) -> None:
+        if not (scope := self.parse_extra_input()) and self.interactive:
+            scope = inputcolor("Look up media of target or all targets (target/all) [target]: ", CYAN)
+
+        if not (user_input := self.parse_extra_input()) and self.interactive:
+            user_input = inputcolor("Max hash distance [8]: ", CYAN)
+        try:
+            distance = int(user_input) if user_input else 8
+        except ValueError:
+            printcolor("Invalid number", RED)
+            return
+
+        index = MediaIndex(self.state.file("media_index.db"))
+        errors = index.index(
+            self._get_media_files(),
+            lambda count, total: printcolor(f"Indexed {count} of {total} new files", BLUE, end="\033[K\r")
+        )
+        print()
+        for path, e in errors:
+            printcolor(f"{YELLOW}{path}{RESET} generated an exception: {e}", RED)
+        if index.skipped:
+            printcolor(f"Skipped {len(index.skipped)} videos, install ffmpeg to index them", YELLOW)
+
+        matches = index.similar(distance, None if scope == "all" else [self.target_name])
+        if not matches:
+            printcolor("No similar media found", RED)
+            return
+
+        table = prettytable.PrettyTable()
+        table.field_names = ["path", "target", "match_path", "match_target", "distance"]
+
+        if self.json:
+            data = []
+
+        for path, target, match_path, match_target, match_distance in matches:
+            path, match_path = os.path.relpath(path, self.output), os.path.relpath(match_path, self.output)
+            table.add_row([path, target, match_path, match_target, match_distance])
+
+            if self.json:
+                data.append({"path": path, "target": target, "match_path": match_path, "match_target": match_target, "distance": match_distance})
+
+        print(table.get_string())
+        printcolor(f"Found {len(matches)} similar media pairs", GREEN)
+
+        self._save_to_files(data, table, "similar-media", "similar media")
+
     def stories(self) -> None:
         stories = self._get_user_stories()
         count = self._download_media_threaded(stories)
@@ -604,6 +1144,95 @@ class Intelgram:
         self.target_name = new_target
         self._print_target()
 
+    def thumbnails(self) -> None:
+        thumbnails = Thumbnails(self.output, self._get_thumbnails_folder(), self.state)
+        files = self._get_media_files()
+        errors = thumbnails.update(
+            files,
+            lambda count, total: printcolor(f"Processed {count} of {total} new files", BLUE, end="\033[K\r")
+        )
+        print()
+        for path, e in errors:
+            printcolor(f"{YELLOW}{path}{RESET} generated an exception: {e}", RED)
+        if thumbnails.skipped:
+            printcolor(f"Skipped {len(thumbnails.skipped)} videos, install ffmpeg to make their poster frames", YELLOW)
+
+        if not thumbnails.processed:
+            printcolor("No downloaded media found", RED)
+            return
+
+        targets = sorted({entry["target"] for entry in thumbnails.processed.values()})
+        printcolor(f"Found {len(thumbnails.processed)} thumbnails of {len(targets)} targets", GREEN)
+        if self.target_name in targets:
+            printcolor(f"Successfully saved {self.target_name} contact sheets to thumbnails/{self.target_name}/index.html", GREEN)
+
+    def watch(self) -> None:
+        if not (targets := self._get_usernames("Usernames to watch")):
+            printcolor("No targets given!", RED)
+            return
+
+        if not (user_input := self.parse_extra_input()) and self.interactive:
+            user_input = inputcolor("Poll interval in minutes [60]: ", CYAN)
+        try:
+            base_interval = float(user_input) * 60 if user_input else 3600
+        except ValueError:
+            printcolor("Invalid number", RED)
+            return
+
+        watched = self.state.load("watch", {})
+        for username in targets:
+            watched.setdefault(username, {"id": None, "seen": {}, "interval": base_interval, "next": 0})
+
+        printcolor(f"Watching {len(targets)} targets, press Ctrl-C to stop", GREEN)
+        try:
+            while True:
+                now = time.time()
+                due = [username for username in targets if watched[username]["next"] <= now]
+                batch = self.scheduler.map(lambda username: (username, self._poll_stories(watched, username)), due, "stories")
+                medias = []
+                for _, username, stories in batch:
+                    entry = watched[username]
+                    # Poll active targets more often, and quiet ones less often
+                    if stories:
+                        entry["interval"] = max(base_interval / 4, entry["interval"] / 2)
+                    else:
+                        entry["interval"] = min(base_interval * 4, entry["interval"] * 1.25)
+                    medias.extend({"item": story, "path": self.output, "target": username} for story in stories)
+
+                for error in batch.errors:
+                    printcolor(f"{YELLOW}{error.item}{RESET} generated an exception: {error.exception}", RED)
+                    if isinstance(error.exception, UserNotFound):
+                        # Renamed or deleted accounts fail the same way on every poll
+                        printcolor(f"Stopped watching {error.item}", YELLOW)
+                        targets = [username for username in targets if username != error.item]
+                        due = [username for username in due if username != error.item]
+                        watched.pop(error.item, None)
+                if not targets:
+                    printcolor("No targets left to watch", RED)
+                    break
+                for username in due:
+                    # Failed polls are retried after the current interval as well
+                    watched[username]["next"] = now + watched[username]["interval"] * random.uniform(0.8, 1.2)
+
+                if medias:
+                    printcolor(f"Found {len(medias)} new stories", GREEN)
+                    self._download_media_threaded(medias, lambda data: watched[data["target"]]["seen"].update(
+                        {data["item"]["pk"]: int(data["item"]["taken_at"].timestamp())}
+                    ))
+
+                # Stories expire after 24 hours, older pks can't show up again
+                for entry in watched.values():
+                    entry["seen"] = {pk: taken_at for pk, taken_at in entry["seen"].items() if taken_at > now - 2 * 86400}
+                self.state.save("watch", watched)
+
+                next_poll = min(watched[username]["next"] for username in targets)
+                printcolor(f"Next poll at {time.strftime('%H:%M:%S', time.localtime(next_poll))}", BLUE, end="\033[K\r")
+                time.sleep(max(0, next_poll - time.time()))
+        except KeyboardInterrupt:
+            print()
+            printcolor("Stopped watching", GREEN)
+        self.state.save("watch", watched)
+
     def viewcount(self) -> None:
         posts = self._get_user_medias()
 
@@ -638,8 +1267,8 @@ class Intelgram:
     def _save_to_files(self, data: dict[str, Any], table: prettytable.PrettyTable, filename_suffix: str, text: str = None):
         filename = f"{self.target_name}_{filename_suffix}"
         if self.json:
-            self._write_json(data, filename)
-            printcolor(f"Successfully saved {self.target_name} {text or filename_suffix} to {filename}.json", GREEN)
+            json_filename = self._write_json(data, filename)
+            printcolor(f"Successfully saved {self.target_name} {text or filename_suffix} to {json_filename}", GREEN)
 
         if self.txt:
             table.set_style(self.table_style)
@@ -683,72 +1312,129 @@ class Intelgram:
 
     ### HELPERS ###    
     def _download_highlights(self, download_folders: list) -> int:
-        medias = []
+        """Resolve and download highlight folders in one pipeline.
+
+        Folders whose latest item and item count didn't change since the last run are skipped,
+        and only new items are downloaded from the changed ones.
+        """
+        state_name = f"{self.target_id}_highlights"
+        state = self.state.load(state_name, {})
         duplicate_names = [name for name in download_folders if download_folders.count(name) > 1]
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = [executor.submit(self.client.highlight_info_v1, folder["pk"]) for folder in download_folders]
-            for future in futures:
-                try:
-                    result = future.result().dict()
-                except Exception as e:
-                    printcolor(f"{YELLOW}{repr(future)}{RESET} generated an exception: {e}", RED)
-                else:
-                    title = f"{result['title'] + ('_' + result['pk'] if result['title'] in duplicate_names else '')}"
-                    path = f"{self.output}/{title}"
-                    os.makedirs(path, exist_ok=True)
-                    self._download_media({
-                        "url": result["cover_media"]["cropped_image_version"]["url"],
-                        "path": f"{path}/{self.target_name}_{title}_cover.jpg"
-                    })
-                    medias.extend({"item": item, "path": f"{self.output}/{title}"} for item in result["items"])
-
-        return self._download_media_threaded(medias)
+        changed = [folder for folder in download_folders if state.get(folder["pk"], {}).get("marker") != self._highlight_marker(folder)]
+        if skipped := len(download_folders) - len(changed):
+            printcolor(f"Skipped {skipped} unchanged highlight folders", BLUE)
+
+        resolved = {}
+        batch = self.scheduler.map(self._get_highlight_info, [folder["pk"] for folder in changed], "highlights")
+
+        def medias() -> Iterator[dict[str, Any]]:
+            for _, _, result in batch:
+                title = f"{result['title'] + ('_' + result['pk'] if result['title'] in duplicate_names else '')}"
+                path = f"{self.output}/{title}"
+                os.makedirs(path, exist_ok=True)
+
+                folder_state = state.setdefault(result["pk"], {"marker": None, "items": []})
+                resolved[result["pk"]] = [item["pk"] for item in result["items"]]
+                yield {
+                    "url": result["cover_media"]["cropped_image_version"]["url"],
+                    "path": f"{path}/{self.target_name}_{title}_cover.jpg"
+                }
+                yield from ({"item": item, "path": path, "folder": result["pk"]} for item in result["items"] if item["pk"] not in folder_state["items"])
+
+        def downloaded(data: dict[str, Any]) -> None:
+            if "folder" in data:
+                state[data["folder"]]["items"].append(data["item"]["pk"])
+
+        count = self._download_media_threaded(self.scheduler.stream(medias()), downloaded)
+        self._print_errors(batch)
+
+        # A folder only counts as unchanged once every one of its items is downloaded
+        for folder in changed:
+            if folder["pk"] in resolved and set(resolved[folder["pk"]]) <= set(state[folder["pk"]]["items"]):
+                state[folder["pk"]]["marker"] = self._highlight_marker(folder)
+        self.state.save(state_name, state)
+
+        return count
     
     def _download_media(self, data: dict[str, Any]) -> None:
         media = data.get("item", data)
         path = data.get("path", self.output)
+        target = data.get("target", self.target_name)
 
         if "media_type" in media:
-            if (username := media["user"]["username"]) is None or username == self.target_name:
-                name_prefix = self.target_name
+            if (username := media["user"]["username"]) is None or username == target:
+                name_prefix = target
             else:
-                name_prefix = f"{self.target_name}_tagged-by_{username}"
+                name_prefix = f"{target}_tagged-by_{username}"
             
-            filename = f"{name_prefix}_{media['pk']}_{int(media['taken_at'].timestamp())}"
+            filename = f"{name_prefix}_{media['pk']}_{analytics.to_timestamp(media['taken_at'])}"
             match media["media_type"]:
                 case 1:
-                    url = media["thumbnail_url"]
-                    urllib.request.urlretrieve(url, f"{path}/{filename}.jpg")
+                    url, file = media["thumbnail_url"], f"{path}/{filename}.jpg"
                 case 2:
-                    url = media["video_url"]
-                    urllib.request.urlretrieve(url, f"{path}/{filename}.mp4")
+                    url, file = media["video_url"], f"{path}/{filename}.mp4"
+                case _:
+                    return
         else:
-            urllib.request.urlretrieve(media["url"], path)
+            url, file = media["url"], path
+
+        urllib.request.urlretrieve(url, file)
+        self.state.append("downloads", {"path": file, "target": target, "pk": media.get("pk"), "time": int(time.time())})
     
-    def _download_media_threaded(self, medias: list[dict]) -> int:
-        for idx, data in enumerate(medias):
-            if data.get("media_type", None) == 8:
-                for item in reversed(data["resources"]):
-                    medias.insert(idx, {"taken_at": data["taken_at"], **item})
+    def _download_profile_pic(self, user: dict[str, Any]) -> bool:
+        """Download an avatar, storing each distinct image once and linking it to the user's file.
+
+        Returns True if the image wasn't stored before (e.g. not a default avatar).
+        """
+        with urllib.request.urlopen(user["profile_pic_url"]) as response:
+            content = response.read()
+        digest = hashlib.sha256(content).hexdigest()
+        blob = self.state.file(f"profile-pics/{digest}.jpg")
+
+        if new := not os.path.isfile(blob):
+            with open(f"{blob}.{threading.get_ident()}.tmp", "wb") as f:
+                f.write(content)
+            os.replace(f"{blob}.{threading.get_ident()}.tmp", blob)
+
+        self._link_profile_pic(blob, user["path"])
+        self.state.append("profile-pics", {
+            "pk": str(user["pk"]),
+            "url": urllib.parse.urlsplit(user["profile_pic_url"]).path,
+            "hash": digest,
+            "time": int(time.time())
+        })
+        return new
+
+    def _link_profile_pic(self, blob: str, path: str) -> None:
+        if os.path.lexists(path):
+            os.remove(path)
+        try:
+            os.link(blob, path)
+        except OSError:
+            # Filesystems without hard links get a copy
+            shutil.copyfile(blob, path)
+
+    def _download_media_threaded(self, medias: list[dict] | Feed, downloaded: Callable = None) -> int:
+        if isinstance(medias, list):
+            for idx, data in enumerate(medias):
+                if data.get("media_type", None) == 8:
+                    for item in reversed(data["resources"]):
+                        medias.insert(idx, {"taken_at": data["taken_at"], **item})
         
-        count = 0
-        total = len(medias)
-        start_time = time.time()
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = [executor.submit(self._download_media, media) for media in medias]
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    _ = future.result()
-                except Exception as e:
-                    printcolor(f"{YELLOW}{repr(future)}{RESET} generated an exception: {e}", RED)
-                else:
-                    count += 1
-                    remaining_time = calculate_remaining_time(start_time, count, total)
-                    printcolor(f"Downloaded {count} {'files' if count > 1 else 'file'}. {BLUE}Remaining time: {remaining_time}", GREEN, end="\033[K\r")
-        print()
+        batch = self.scheduler.map(self._download_media, medias, "download")
+        self._drain(
+            batch,
+            lambda _, data, __: downloaded and downloaded(data),
+            lambda count, _, remaining_time: printcolor(
+                f"Downloaded {count} {'files' if count > 1 else 'file'}. {BLUE}Remaining time: {remaining_time}", GREEN, end="\033[K\r"
+            )
+        )
+        return batch.completed
 
-        return count
+    @staticmethod
+    def _highlight_marker(folder: dict[str, Any]) -> str:
+        return f"{folder.get('latest_reel_media')}_{folder.get('media_count')}"
 
     def _get_captions(self) -> list[dict[str, str | int]]:
         posts = self._get_user_medias()
@@ -760,26 +1446,57 @@ class Intelgram:
 
     def _get_comments(self, id: str) -> tuple[str, list[dict[str, Any]]]:
         comments = self.client.media_comments(id)
-        return (id, [comment.dict() for comment in comments])
-
-    def _get_comments_threaded(self, posts: list) -> list[tuple[str, list[dict[str, Any]]]]:
-        comments = []
-        start_time = time.time()
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            futures = [executor.submit(self._get_comments, post["id"]) for post in posts]
-            for idx, future in enumerate(futures):
-                remaining_time = calculate_remaining_time(start_time, idx, len(posts))
-                printcolor(f"Checking post {idx + 1} of {len(posts)}. Remaining time: {remaining_time}", BLUE, end="\033[K\r")
-                try:
-                    result = future.result()
-                except Exception as e:
-                    printcolor(f"{YELLOW}{repr(future)}{RESET} generated an exception: {e}", RED)
-                else:
-                    if result[1]:
-                        comments.append(result)
-        print()
-
-        return comments
+        return (id, [self._comment_dict(comment) for comment in comments])
+
+    def _get_comments_threaded(self, posts: Iterable) -> list[tuple[str, list[dict[str, Any]]]]:
+        if self.update:
+            return self._refresh_threaded(posts, "comments", "comment_count", self._get_new_comments, self._get_comments)
+
+        ids = self.scheduler.stream(post["id"] for post in posts)
+        results = self._run_threaded(self._get_comments, ids, "comments", "Checking post")
+        return [result for result in results if result[1]]
+
+    def _get_new_comments(self, post: dict[str, Any], stored: dict[str, Any] | None) -> list[dict[str, Any]]:
+        """Stored comments of a post plus the ones added since.
+
+        comment_count includes replies, which aren't fetched, so it only tells whether something
+        changed and not how many comments to fetch. Pages are fetched from the newest until one
+        reaches a stored comment, which falls back to every page if the order isn't newest first.
+        """
+        if not stored or post["comment_count"] < stored["count"]:
+            return self._get_comments(post["id"])[1]
+
+        last_pk = max((int(comment["pk"]) for comment in stored["items"]), default=0)
+        client = self.client
+        media_id = client.media_id(post["id"])
+        params = None
+        comments = {}
+        while True:
+            # The response is used rather than client.last_json, which the next request replaces
+            result = client.private_request(f"media/{media_id}/comments/", params)
+            page = [instagrapi.extractors.extract_comment(comment) for comment in result.get("comments") or []]
+            comments.update((comment.pk, comment) for comment in page if int(comment.pk) > last_pk)
+            if any(int(comment.pk) <= last_pk for comment in page) or not (result.get("has_more_comments") and result.get("next_max_id")):
+                break
+            params = {"max_id": result["next_max_id"]}
+        return stored["items"] + [self._comment_dict(comment) for comment in comments.values()]
+
+    def _comment_dict(self, comment: instagrapi.types.Comment) -> dict[str, Any]:
+        if self.json:
+            return comment.dict()
+
+        # Only the fields shown in the table
+        return {
+            "pk": comment.pk,
+            "user": {
+                "pk": comment.user.pk,
+                "username": sys.intern(comment.user.username or ""),
+                "full_name": sys.intern(comment.user.full_name or "")
+            },
+            "created_at_utc": comment.created_at_utc,
+            "like_count": comment.like_count,
+            "text": comment.text
+        }
 
     def _get_hashtag_data(self, caption: str) -> tuple[str, list[dict[str, str | int]]]:
         if hashtags := re.findall("#\w*[a-zA-Z]+\w*", caption["caption"]):
@@ -798,7 +1515,7 @@ class Intelgram:
             return (
                 post["id"],
                 {
-                    "taken_at": int(post["taken_at"].timestamp()),
+                    "taken_at": analytics.to_timestamp(post["taken_at"]),
                     "loc_pk": post["location"]["pk"],
                     "name": post["location"]["name"],
                     "address": location_data.address,
@@ -808,36 +1525,158 @@ class Intelgram:
             )
         return None
 
-    def _get_media_likers(self, id: str) -> list[tuple[str, list[dict[str, Any]]]]:
+    def _get_highlight_info(self, pk: str) -> dict[str, Any]:
+        return self.client.highlight_info_v1(pk).dict()
+
+    def _get_media_likers(self, id: str) -> tuple[str, UserList]:
         likers = self.client.media_likers(id)
-        return (id, [liker.dict() for liker in likers])
+        return (id, UserList(likers, self._user_fields()))
 
-    def _get_media_likers_threaded(self, posts: list) -> list[tuple[str, list[dict[str, Any]]]]:
-        likers = []
-        start_time = time.time()
-        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-            futures = [executor.submit(self._get_media_likers, post["id"]) for post in posts]
-            for idx, future in enumerate(futures):
-                remaining_time = calculate_remaining_time(start_time, idx, len(posts))
-                printcolor(f"Checking post {idx + 1} of {len(posts)}. Remaining time: {remaining_time}", BLUE, end="\033[K\r")
-                try:
-                    result = future.result()
-                except Exception as e:
-                    printcolor(f"{YELLOW}{repr(future)}{RESET} generated an exception: {e}", RED)
-                else:
-                    if result[1]:
-                        likers.append(result)
-        print()
+    def _get_media_likers_threaded(self, posts: Iterable) -> list[tuple[str, UserList | list[dict[str, Any]]]]:
+        if self.update:
+            return self._refresh_threaded(
+                posts, "likers", "like_count", lambda post, _: self._get_media_likers(post["id"])[1], self._get_media_likers
+            )
 
-        return likers
+        ids = self.scheduler.stream(post["id"] for post in posts)
+        results = self._run_threaded(self._get_media_likers, ids, "likers", "Checking post")
+        return [result for result in results if result[1]]
+
+    def _count_interactions(self) -> tuple[dict[str, list[int]], dict[str, dict[str, str]], list[str]]:
+        """Interactions per user pk and kind, aggregated in one streaming pass over the saved outputs.
+
+        Returns the counts (in INTERACTION_WEIGHTS order), the user dicts and the kinds without a saved output.
+        """
+        counts = {}
+        users = {}
+        missing = []
+        for idx, kind in enumerate(INTERACTION_WEIGHTS):
+            if not (path := output.find(f"{self.output}/{self.target_name}_{kind}")):
+                missing.append(kind)
+                continue
 
-    def _get_user_followers(self, pk: str = None) -> list[dict[str, Any]]:
-        return [user.dict() for user in self.client.user_followers_v1(pk or self.target_id)]
+            for _, value in output.iterate(path):
+                for user in self._get_post_users(value):
+                    if (pk := str(user["pk"])) == str(self.target_id):
+                        continue
+                    counts.setdefault(pk, [0] * len(INTERACTION_WEIGHTS))[idx] += 1
+                    users.setdefault(pk, {"pk": pk, "username": user.get("username"), "full_name": user.get("full_name")})
+
+        return counts, users, missing
+
+    def _get_engagement_data(self, username: str, offline: bool = False) -> tuple[list[dict[str, Any]], int]:
+        """Medias and follower count of a user.
+
+        Offline, they are read from saved posts-data and info files when those exist.
+        """
+        posts_file = offline and output.find(f"{self.output}/{username}_posts-data")
+        info_file = offline and output.find(f"{self.output}/{username}_info")
+        if posts_file and info_file:
+            return output.load(posts_file), output.load(info_file)["follower_count"]
+
+        pk = self.target_id if username == self.target_name else self.client.user_id_from_username(username)
+        medias = output.load(posts_file) if posts_file else list(self._iter_user_medias(pk))
+        follower_count = output.load(info_file)["follower_count"] if info_file else self._get_user_info_v1(pk)["follower_count"]
+        return medias, follower_count
+
+    def _get_post_users(self, value: list | dict[str, Any]) -> list[dict[str, Any]]:
+        """Users in one value of a per-post output."""
+        if isinstance(value, list):
+            # comments, likers
+            return [item["user"] if "user" in item else item for item in value]
+        if "usertags" in value:
+            # tagged, tagged-with
+            return [tag["user"] for tag in value["usertags"]]
+        # tagged-target
+        return [value["user"]]
+
+    def _get_thumbnails_folder(self) -> str:
+        return f"{self.output}/thumbnails"
+
+    def _get_search_index(self) -> SearchIndex:
+        if self.search_index is None:
+            self.search_index = SearchIndex(self.state.file("search.db"))
+        return self.search_index
+
+    def _get_follower_pks(self, username: str) -> tuple[str, np.ndarray]:
+        """Sorted follower pks of a user, read from its latest snapshot or saved followers file when one exists."""
+        if (pks := self._get_snapshots().latest(username, "followers")) is not None:
+            return username, pks
+        if path := output.find(f"{self.output}/{username}_followers"):
+            return username, cohort.pk_array(user["pk"] for user in output.iterate(path))
+
+        pk = self.target_id if username == self.target_name else self.client.user_id_from_username(username)
+        return username, cohort.pk_array(self._get_user_followers(pk, username).pks)
+
+    def _get_following_pks(self, pk: int, amount: int = 0) -> list[int]:
+        return [int(user.pk) for user in self.client.user_following_v1(str(pk), amount)]
+
+    def _get_media_files(self) -> dict[str, str]:
+        """Every downloaded image and video in the output dir, mapped to the target it was downloaded for."""
+        targets = {os.path.normpath(record["path"]): record["target"] for record in self.state.records("downloads")}
+        files = {}
+        generated = {os.path.realpath(self.state.path), os.path.realpath(self._get_thumbnails_folder())}
+        for root, dirs, filenames in os.walk(self.output):
+            # Skip generated files and profile pics, which don't belong to a target
+            dirs[:] = [name for name in dirs if os.path.realpath(os.path.join(root, name)) not in generated
+                and not name.endswith("_profile-pics")]
+            for filename in filenames:
+                if filename.lower().endswith(IMAGE_EXTENSIONS + VIDEO_EXTENSIONS):
+                    path = os.path.normpath(os.path.join(root, filename))
+                    # Files downloaded before the manifest existed are named <target>_...
+                    files[path] = targets.get(path, filename.split("_")[0])
+        return files
+
+    def _get_user_followers(self, pk: str = None, username: str = None) -> UserList:
+        # Fetched page by page, so only one page of pydantic models is alive at a time
+        followers = UserList(fields=self._user_fields())
+        max_id = ""
+        while True:
+            users, max_id = self.client.user_followers_v1_chunk(pk or self.target_id, USER_PAGE_SIZE, max_id)
+            followers.extend(users)
+            if not max_id:
+                self._add_snapshot(pk, username, "followers", followers)
+                return followers
         
-    def _get_user_followings(self, pk: str = None) -> list[dict[str, Any]]:
-        return [user.dict() for user in self.client.user_following_v1(pk or self.target_id)]
+    def _get_user_followings(self, pk: str = None, username: str = None) -> UserList:
+        # Paged like user_following_v1, but only one page of pydantic models is alive at a time
+        followings = UserList(fields=self._user_fields())
+        client = self.client
+        params = {
+            "rank_token": client.rank_token,
+            "search_surface": "follow_list_page",
+            "includes_hashtags": "true",
+            "enable_groups": "true",
+            "query": "",
+            "count": USER_PAGE_SIZE
+        }
+        while True:
+            result = client.private_request(f"friendships/{pk or self.target_id}/following/", params=params)
+            followings.extend(instagrapi.extractors.extract_user_short(user) for user in result["users"])
+            if not (max_id := result.get("next_max_id")):
+                self._add_snapshot(pk, username, "followings", followings)
+                return followings
+            params["max_id"] = max_id
+
+    def _add_snapshot(self, pk: str | None, username: str | None, kind: str, users: UserList) -> None:
+        if not pk:
+            pk, username = self.target_id, self.target_name
+        self._get_snapshots().add(pk, username, kind, users)
+
+    def _get_snapshots(self) -> SnapshotStore:
+        if self.snapshots is None:
+            self.snapshots = SnapshotStore(self.state.file("snapshots.db"))
+        return self.snapshots
+
+    def _user_fields(self) -> tuple[str, ...]:
+        """Optional user fields to keep in a UserList, only needed for JSON output."""
+        if not self.json:
+            return ()
+        return tuple(field for field in instagrapi.types.UserShort.__fields__ if field not in ("pk", "username", "full_name"))
 
     def _get_user_info_v1(self, pk: str = None) -> dict[str, Any]:
+        if self.prefetcher and (not pk or pk == self.target_id):
+            return self.prefetcher.get(self.target_id, "info", lambda: self.client.user_info_v1(self.target_id).dict())
         return self.client.user_info_v1(pk or self.target_id).dict()
 
     def _get_user_info_gql(self, pk: str = None) -> dict[str, Any]:
@@ -846,36 +1685,245 @@ class Intelgram:
         return self.client.user_info_v1(pk or self.target_id).dict()
 
     def _get_user_info_gql_threaded(self, users: list) -> list[dict[str, Any]]:
-        data = []
         max_workers = 4 if len(users) < 100 else 2 if len(users) < 200 else 1
-        start_time = time.time()
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = [executor.submit(self._get_user_info_gql, pk) for pk in users]
-            for idx, future in enumerate(futures):
-                remaining_time = calculate_remaining_time(start_time, idx, len(users))
-                printcolor(f"Getting user {idx + 1} of {len(users)} users. Remaining time: {remaining_time}", BLUE, end="\033[K\r")
-                try:
-                    result = future.result()
-                except Exception as e:
-                    printcolor(f"{YELLOW}{repr(future)}{RESET} generated an exception: {e}", RED)
-                else:
-                    data.append(result)
-        print()
-        
-        return data
+        return self._run_threaded(self._get_user_info_gql, users, "user_info", "Getting user", max_workers)
 
     def _get_user_medias(self) -> list[dict[str, Any]]:
-        return [media.dict() for media in self.client.user_medias_v1(self.target_id)]
+        return list(self._iter_user_medias())
+
+    def _iter_file_users(self, path: str) -> Iterator[dict[str, Any]]:
+        """Users of a saved user list or per-post output, streamed and with duplicates."""
+        for item in output.iterate(path):
+            if isinstance(item, tuple):
+                yield from self._get_post_users(item[1])
+            else:
+                yield item
+
+    def _iter_user_medias(self, pk: str = None) -> Iterator[dict[str, Any]]:
+        """Yield the target's medias page by page, so callers can start working before pagination ends."""
+        if self.prefetcher and (not pk or pk == self.target_id):
+            if (medias := self.prefetcher.get(self.target_id, "medias", lambda: None)) is not None:
+                yield from medias
+                return
+
+        for page in self._iter_media_pages(pk):
+            yield from page
+
+    def _iter_media_pages(self, pk: str = None) -> Iterator[list[dict[str, Any]]]:
+        # The cursor is read from the client's last response, so no other thread may use this client in between
+        client = self.clients.clone()
+        end_cursor = ""
+        count = 0
+        try:
+            while True:
+                medias, end_cursor = client.user_medias_paginated_v1(pk or self.target_id, end_cursor=end_cursor)
+                # instagrapi logs request errors and returns a None cursor instead of raising
+                if end_cursor is None:
+                    raise ClientError(f"Fetching the posts of {pk or self.target_name} failed after {count} posts, the list is incomplete")
+                count += len(medias)
+                yield [media.dict() for media in medias]
+                if not end_cursor:
+                    break
+        finally:
+            self.clients.release(client)
+
+    def _get_user_list_file(self) -> str | None:
+        """Name of a saved output with users in it, as accepted by info-list."""
+        if not (filename := self.parse_extra_input()) and self.interactive:
+            filename = inputcolor("Filename (relative to the output dir): ", CYAN)
+        
+        valid_names = ["_comments", "_followers", "_followers-subset", "_followings", "_followings-subset",
+            "_likers", "_tagged", "_tagged-target", "_tagged-with"]
+        if not (os.path.isfile(f"{self.output}/{filename}") and re.findall(f"({'|'.join(valid_names)}){output.EXTENSION_PATTERN}", filename)):
+            printcolor(f"No valid file exists with the name: {filename}", RED)
+            return None
+        return filename
 
-    def _get_user_stories(self) -> list[dict[str, Any]] | list:
+    def _get_usernames(self, prompt: str) -> list[str]:
+        if not (user_input := self.parse_extra_input()) and self.interactive:
+            user_input = inputcolor(f"{prompt} (comma separated, or a .txt file relative to the output dir): ", CYAN)
+
+        if user_input.endswith(".txt"):
+            try:
+                with open(f"{self.output}/{user_input}") as f:
+                    return [line.strip() for line in f if line.strip()]
+            except FileNotFoundError:
+                printcolor(f"No file exists with the name: {user_input}", RED)
+                return []
+        return [username for username in user_input.replace(" ", "").split(",") if username]
+
+    def _get_user_stories(self, pk: str = None) -> list[dict[str, Any]] | list:
         try:
-            return [story.dict() for story in self.client.user_stories_v1(self.target_id)]
+            return [story.dict() for story in self.client.user_stories_v1(pk or self.target_id)]
         except IndexError:
             return []
 
     def _get_usertag_medias(self) -> list[dict[str, Any]]:
         return [usertag.dict() for usertag in self.client.usertag_medias_v1(self.target_id)]
 
+    def _poll_stories(self, watched: dict[str, Any], username: str) -> list[dict[str, Any]]:
+        """Stories of a watched user that weren't downloaded yet."""
+        entry = watched[username]
+        if not entry["id"]:
+            entry["id"] = self.client.user_id_from_username(username)
+        return [story for story in self._get_user_stories(entry["id"]) if story["pk"] not in entry["seen"]]
+
+    def _run_job(self, job: dict[str, Any]) -> dict[str, list[str]]:
+        """Run a serve mode job on a view of this instance, sharing the session and the scheduler."""
+        view = self._view(job["target"])
+        view.extra_input = list(job["extra_input"])
+        view.interactive = False
+        view.json = True
+
+        try:
+            getattr(view, job["command"].replace("-", "_"))()
+        finally:
+            self.clients.sync(self.settings_path)
+        return {"files": view.written}
+
+    def _view(self, target: str, target_id: str = None) -> Intelgram:
+        """Shallow copy of this instance with another target."""
+        view = copy.copy(self)
+        view.written = []
+        view.target_name = target
+        if not target_id and target not in self.target_ids:
+            self.target_ids[target] = self.client.user_id_from_username(target)
+        view.target_id = target_id or self.target_ids[target]
+        return view
+
+    def _print_errors(self, batch: Batch, retry_func: Callable | None = None) -> None:
+        """Print the errors of a batch and save its failed items.
+
+        Items of a closure are saved as calls of `retry_func` on their id.
+        """
+        if batch.cancelled:
+            printcolor(f"Cancelled, kept {batch.completed} finished results", YELLOW)
+
+        for error in batch.errors:
+            item = error.item["id"] if isinstance(error.item, dict) and "id" in error.item else error.item
+            printcolor(f"{YELLOW}{error.family} {item}{RESET} generated an exception: {error.exception}", RED)
+
+        if self.scheduler.is_open(batch.family):
+            printcolor(f"Too many failed {batch.family} requests, paused them for a while", YELLOW)
+
+        failed = [
+            (error.item["id"] if retry_func else error.item, error.exception)
+            for error in batch.errors if error.idx >= 0
+        ]
+        self._record_failures(retry_func or batch.func, batch.family, failed)
+
+    def _record_failures(self, func: Callable, family: str, failed: list[tuple[Any, Exception]]) -> None:
+        """Save transient failures for the retry command and the others once to the failed log."""
+        # Only Intelgram methods can be re-driven later by the retry command
+        if not failed or not isinstance(getattr(func, "__self__", None), Intelgram):
+            return
+
+        retried = 0
+        for item, exception in failed:
+            transient = self._is_transient(exception)
+            retried += transient
+            self.state.append("retry" if transient else "failed", {
+                "func": func.__name__,
+                "family": family,
+                "target": self.target_name,
+                "target_id": self.target_id,
+                "item": item,
+                "error": repr(exception),
+                "time": int(time.time())
+            })
+        if retried:
+            printcolor(f"Saved {retried} failed items, run the retry command to fetch them again", YELLOW)
+        if len(failed) > retried:
+            printcolor(f"{len(failed) - retried} items failed permanently, they won't be retried", YELLOW)
+
+    @staticmethod
+    def _is_transient(e: Exception) -> bool:
+        """Whether `e` is a network error or throttling, which might pass on its own."""
+        if isinstance(e, urllib.error.HTTPError):
+            return e.code == 429 or e.code >= 500
+        if isinstance(e, (urllib.error.URLError, *TRANSIENT_ERRORS)):
+            return True
+        return isinstance(e, ClientError) and isinstance(e.code, int) and (e.code == 429 or e.code >= 500)
+
+    def _refresh_threaded(self, posts: Iterable, name: str, counter: str, fetch: Callable,
+            retry_func: Callable) -> list[tuple[str, list[dict[str, Any]]]]:
+        """Like the *_threaded helpers, but only re-fetches posts whose `counter` changed since the last run.
+
+        Failed posts are saved for the retry command as calls of `retry_func` on the post id.
+        """
+        state_name = f"{self.target_id}_{name}"
+        state = self.state.load(state_name, {})
+
+        def refresh(post: dict[str, Any]) -> tuple[str, list[dict[str, Any]], bool]:
+            if (stored := state.get(post["id"])) and stored["count"] == post[counter]:
+                return (post["id"], stored["items"], True)
+
+            items = list(fetch(post, stored))
+            state[post["id"]] = {"count": post[counter], "items": items}
+            return (post["id"], items, False)
+
+        results = self._run_threaded(refresh, self.scheduler.stream(posts), name, "Checking post", retry_func=retry_func)
+        self.state.save(state_name, state)
+        printcolor(f"Skipped {sum(result[2] for result in results)} unchanged posts", BLUE)
+
+        return [(id, items) for id, items, _ in results if items]
+
+    def _run_threaded(self, func: Callable, items: list | Feed, family: str, text: str, workers: int = None,
+            retry_func: Callable | None = None) -> list:
+        """Run `func` on every item through the scheduler, returning the results in input order.
+
+        With a Feed the total grows while the producer is still running.
+        """
+        results = []
+        batch = self.scheduler.map(func, items, family, workers)
+        self._drain(
+            batch,
+            lambda idx, _, result: results.append((idx, result)),
+            lambda count, total, remaining_time: printcolor(
+                f"{text} {count} of {total}. Remaining time: {remaining_time}", BLUE, end="\033[K\r"
+            ),
+            retry_func
+        )
+        return [result for _, result in sorted(results, key=lambda result: result[0])]
+
+    @staticmethod
+    def _retry_output(results: list) -> dict[str, Any] | list:
+        """Recovered results in the shape of their command's output, (key, value) results become a dict."""
+        def plain(value: Any) -> Any:
+            if isinstance(value, UserList):
+                return list(value)
+            return value.tolist() if isinstance(value, np.ndarray) else value
+
+        if all(isinstance(result, tuple) and len(result) == 2 for result in results):
+            return {key: plain(value) for key, value in results}
+        return [plain(result) for result in results]
+
+    def _drain(self, batch: Batch, handle: Callable[[int, Any, Any], None], progress: Callable[[int, int, str], None] | None = None,
+            retry_func: Callable | None = None, report: bool = True) -> None:
+        """Pass every result of `batch` to `handle` until it ends or Ctrl-C cancels it, then sync the session.
+
+        `progress` gets the finished count, the total and the remaining time after each result.
+        With `report` the errors are printed and saved by _print_errors.
+        """
+        start_time = time.time()
+        iterator = iter(batch)
+        try:
+            for idx, item, result in iterator:
+                handle(idx, item, result)
+                if progress:
+                    total = len(batch.items)
+                    # Takes the index of the last finished item, a Feed may not have counted it yet
+                    progress(batch.completed, total, calculate_remaining_time(start_time, batch.completed - 1, max(total, batch.completed)))
+        except KeyboardInterrupt:
+            batch.cancelled = True
+        finally:
+            iterator.close()
+        if progress:
+            print()
+        if report:
+            self._print_errors(batch, retry_func)
+        self.clients.sync(self.settings_path)
+
     def parse_extra_input(self) -> str:
         return self.extra_input.pop(0) if self.extra_input else ""
 
@@ -913,6 +1961,9 @@ class Intelgram:
         except UserNotFound as e:
             printcolor(f"Error: {e.message}", RED)
             sys.exit(1)
+
+        if self.prefetcher:
+            self._start_prefetch()
         
         friendship = self.client.user_friendship_v1(self.target_id).dict()
         is_private = ""
@@ -933,9 +1984,20 @@ class Intelgram:
         
         printcolor(f"Target: {MAGENTA}{self.target_name} {BLUE}[{self.target_id}] {is_private} {status}", GREEN)
     
-    def _write_json(self, data: dict | list, name: str) -> None:
-        with open(f"{self.output}/{name}.json", "w") as f:
-            json.dump(data, f, indent=4, ensure_ascii=False, default=str)
+    def _start_prefetch(self) -> None:
+        """Start fetching the data most commands begin with, while the user types the next command."""
+        pk = self.target_id
+        self.prefetcher.start(pk, {
+            "info": lambda: self.client.user_info_v1(pk).dict(),
+            "medias": lambda: self._iter_media_pages(pk)
+        })
+
+    def _write_json(self, data: dict | Iterable, name: str) -> str:
+        """Write `data` in the selected output format, returns the filename."""
+        filename = f"{name}.{self.output_format}"
+        output.dump(data, f"{self.output}/{filename}")
+        self.written.append(filename)
+        return filename
 
     def _write_txt(self, data: dict | list, name: str) -> None:
         with open(f"{self.output}/{name}.txt", "w") as f:
@@ -0,0 +1,172 @@
+from __future__ import annotations
+import concurrent.futures
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+from typing import Callable, Iterable
+
+from PIL import Image
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+VIDEO_EXTENSIONS = (".mp4",)
+BANDS = 4
+BAND_BITS = 64 // BANDS
+
+
+def dhash(image: Image.Image) -> int:
+    """64 bit difference hash: compares neighbouring pixels of a 9x8 grayscale thumbnail."""
+    pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = value << 1 | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def hash_file(path: str) -> list[int]:
+    """Hashes of an image, or of up to 8 keyframes of a video. Runs in a worker process."""
+    if path.lower().endswith(IMAGE_EXTENSIONS):
+        with Image.open(path) as image:
+            return [dhash(image)]
+
+    # Pillow can't decode videos, keyframes are extracted with ffmpeg when it is installed
+    if not (ffmpeg := shutil.which("ffmpeg")):
+        return []
+    with tempfile.TemporaryDirectory() as tmp:
+        subprocess.run(
+            [ffmpeg, "-loglevel", "error", "-skip_frame", "nokey", "-i", path, "-vsync", "vfr",
+                "-frames:v", "8", "-vf", "scale=64:-1", f"{tmp}/%02d.png"],
+            check=True, stdin=subprocess.DEVNULL
+        )
+        hashes = []
+        for name in sorted(os.listdir(tmp)):
+            with Image.open(f"{tmp}/{name}") as image:
+                hashes.append(dhash(image))
+        return hashes
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _signed(value: int) -> int:
+    # SQLite integers are signed 64 bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+def _bands(value: int) -> list[int]:
+    mask = (1 << BAND_BITS) - 1
+    return [value >> (idx * BAND_BITS) & mask for idx in range(BANDS)]
+
+
+def _neighbours(band: int, radius: int) -> set[int]:
+    values = {band}
+    for _ in range(radius):
+        values |= {value ^ 1 << bit for value in values for bit in range(BAND_BITS)}
+    return values
+
+
+class MediaIndex:
+    """Persistent perceptual hash index with multi-index hashing lookup.
+
+    Each 64 bit hash is split into 4 indexed bands of 16 bits. Two hashes within distance `d`
+    share at least one band within distance `d // 4`, so a lookup only has to probe a few
+    band values instead of scanning the whole index.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, target TEXT, mtime REAL);"
+            "CREATE TABLE IF NOT EXISTS hashes (path TEXT, frame INTEGER, hash INTEGER, "
+            + ", ".join(f"b{idx} INTEGER" for idx in range(BANDS)) + ");"
+            "CREATE INDEX IF NOT EXISTS hashes_path ON hashes (path);"
+            + "".join(f"CREATE INDEX IF NOT EXISTS hashes_b{idx} ON hashes (b{idx});" for idx in range(BANDS))
+        )
+        self.skipped: list[str] = []
+
+    def outdated(self, files: dict[str, str]) -> list[str]:
+        """Paths of `files` (path -> target) that are new or changed since they were indexed."""
+        indexed = dict(self.db.execute("SELECT path, mtime FROM files"))
+        return [path for path in files if indexed.get(path) != os.path.getmtime(path)]
+
+    def index(self, files: dict[str, str], progress: Callable[[int, int], None] | None = None) -> list[tuple[str, Exception]]:
+        """Hash new and changed files in a process pool. Returns the files that failed.
+
+        Files without hashes (videos while ffmpeg isn't installed) are left out of the index, so
+        the next run tries them again, and listed in `skipped`.
+        """
+        paths = self.outdated(files)
+        errors = []
+        self.skipped = []
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            futures = {executor.submit(hash_file, path): path for path in paths}
+            for count, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                path = futures[future]
+                try:
+                    hashes = future.result()
+                except Exception as e:
+                    errors.append((path, e))
+                else:
+                    if hashes:
+                        self._store(path, files[path], hashes)
+                    else:
+                        self._remove(path)
+                        self.skipped.append(path)
+                if progress:
+                    progress(count, len(paths))
+        self.db.commit()
+        return errors
+
+    def similar(self, distance: int, targets: Iterable[str] | None = None) -> list[tuple[str, str, str, str, int]]:
+        """Pairs of different files within `distance`, as (path, target, match_path, match_target, distance).
+
+        With `targets` only files of those targets are looked up, matched against the whole index.
+        """
+        query = "SELECT h.path, f.target, h.hash FROM hashes h JOIN files f USING (path)"
+        if targets is None:
+            rows = self.db.execute(query).fetchall()
+        else:
+            targets = list(targets)
+            rows = self.db.execute(f"{query} WHERE f.target IN ({','.join('?' * len(targets))})", targets).fetchall()
+
+        matches = {}
+        for path, target, value in rows:
+            value = _unsigned(value)
+            for match_path, match_target, match_value in self._candidates(value, distance):
+                if match_path == path:
+                    continue
+                key = tuple(sorted((path, match_path)))
+                current = hamming(value, _unsigned(match_value))
+                if current <= distance and (key not in matches or current < matches[key][4]):
+                    matches[key] = (path, target, match_path, match_target, current)
+
+        return sorted(matches.values(), key=lambda match: match[4])
+
+    def _candidates(self, value: int, distance: int) -> set[tuple[str, str, int]]:
+        candidates = set()
+        for idx, band in enumerate(_bands(value)):
+            values = list(_neighbours(band, distance // BANDS))
+            candidates.update(self.db.execute(
+                f"SELECT h.path, f.target, h.hash FROM hashes h JOIN files f USING (path) WHERE h.b{idx} IN ({','.join('?' * len(values))})",
+                values
+            ))
+        return candidates
+
+    def _remove(self, path: str) -> None:
+        self.db.execute("DELETE FROM hashes WHERE path = ?", (path,))
+        self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def _store(self, path: str, target: str, hashes: list[int]) -> None:
+        self.db.execute("DELETE FROM hashes WHERE path = ?", (path,))
+        self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", (path, target, os.path.getmtime(path)))
+        self.db.executemany(
+            f"INSERT INTO hashes VALUES (?, ?, ?, {', '.join('?' * BANDS)})",
+            [(path, frame, _signed(value), *_bands(value)) for frame, value in enumerate(hashes)]
+        )
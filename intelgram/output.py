@@ -0,0 +1,136 @@
+from __future__ import annotations
+import gzip
+import io
+import itertools
+import json
+import os
+import re
+from typing import Any, BinaryIO, Iterable, Iterator
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FORMATS = ("json", "json.gz", "json.zst", "ndjson", "ndjson.gz", "ndjson.zst")
+EXTENSION_PATTERN = r"\.(?:nd)?json(?:\.gz|\.zst)?$"
+# Keys of the rows of an .ndjson dict output
+NDJSON_KEYS = {"key", "value"}
+# First line of .ndjson files of earlier versions, told whether the lines were list items or [key, value] pairs
+NDJSON_HEADER = "intelgram_ndjson"
+
+
+def available_formats() -> tuple[str, ...]:
+    return FORMATS if zstandard else tuple(fmt for fmt in FORMATS if not fmt.endswith(".zst"))
+
+
+def strip_extension(filename: str) -> str:
+    return re.sub(EXTENSION_PATTERN, "", filename)
+
+
+def find(base: str) -> str | None:
+    """Path of an existing output file `base`.<any format>, preferring the plain .json."""
+    for fmt in FORMATS:
+        if os.path.isfile(f"{base}.{fmt}"):
+            return f"{base}.{fmt}"
+    return None
+
+
+def dump(data: dict | Iterable, path: str) -> None:
+    """Write `data` in the format given by the extension of `path`.
+
+    Plain .json is indented for reading, every other format is compact. In .ndjson files a list
+    is written as one item per line, and a dict as one {"key": ..., "value": ...} object per line,
+    so every line is a record for standard NDJSON tools. Any other iterable is written as a list,
+    one item at a time, so it never has to be held in memory as a whole.
+    """
+    with _open(path, "wb") as f:
+        if ".ndjson" in path:
+            items = ({"key": key, "value": value} for key, value in data.items()) if isinstance(data, dict) else data
+            for item in items:
+                f.write(_dumps(item) + b"\n")
+        elif isinstance(data, dict):
+            f.write(_dumps(data) if re.search(r"\.json\.", path) else _dumps_indented(data))
+        else:
+            _dump_items(f, data, indent=not re.search(r"\.json\.", path))
+
+
+def load(path: str) -> dict | list:
+    with _open(path, "rb") as f:
+        if ".ndjson" not in path:
+            return _loads(f.read())
+
+        is_dict, lines = _ndjson_lines(f)
+        return dict(lines) if is_dict else list(lines)
+
+
+def iterate(path: str) -> Iterator[Any]:
+    """Items of a list output, or (key, value) pairs of a dict output. Streams .ndjson files."""
+    if ".ndjson" not in path:
+        data = load(path)
+        yield from data.items() if isinstance(data, dict) else data
+        return
+
+    with _open(path, "rb") as f:
+        yield from _ndjson_lines(f)[1]
+
+
+def _ndjson_lines(f: BinaryIO) -> tuple[bool, Iterator[Any]]:
+    """Whether an .ndjson file holds a dict, told by the type of its first row, and its lines as list items or (key, value) pairs.
+
+    An empty file loads as an empty list.
+    """
+    lines = (_loads(line) for line in f if line.strip())
+    if (first := next(lines, None)) is None:
+        return False, iter(())
+    if isinstance(first, dict) and first.keys() == NDJSON_KEYS:
+        return True, ((line["key"], line["value"]) for line in itertools.chain([first], lines))
+
+    # Files of earlier versions start with a header line and hold dicts as [key, value] rows
+    if isinstance(first, dict) and NDJSON_HEADER in first:
+        return first[NDJSON_HEADER] == "dict", (tuple(line) if first[NDJSON_HEADER] == "dict" else line for line in lines)
+    return False, itertools.chain([first], lines)
+
+
+def _dump_items(f: BinaryIO, items: Iterable, indent: bool) -> None:
+    """Write a JSON list item by item, the same bytes as dumping the whole list at once."""
+    empty = True
+    for item in items:
+        if indent:
+            f.write(b"[\n    " if empty else b",\n    ")
+            f.write(_dumps_indented(item).replace(b"\n", b"\n    "))
+        else:
+            f.write((b"[" if empty else b",") + _dumps(item))
+        empty = False
+    f.write(b"[]" if empty else b"\n]" if indent else b"]")
+
+
+def _dumps_indented(data: Any) -> bytes:
+    # Readable and byte for byte the same with or without orjson
+    return json.dumps(data, indent=4, ensure_ascii=False, default=str).encode()
+
+
+def _dumps(data: Any) -> bytes:
+    """Compact JSON, datetimes formatted like the stdlib json module's `default=str` does."""
+    if orjson:
+        return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(data, ensure_ascii=False, default=str).encode()
+
+
+def _loads(data: bytes) -> Any:
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def _open(path: str, mode: str) -> BinaryIO:
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    if path.endswith(".zst"):
+        if not zstandard:
+            raise RuntimeError(f"zstandard is required to open {path}")
+        return zstandard.open(path, mode)
+    return io.open(path, mode)
@@ -0,0 +1,97 @@
+from __future__ import annotations
+import concurrent.futures
+import threading
+import time
+from typing import Any, Callable, Iterator
+
+from intelgram.scheduler import Scheduler
+
+
+class Prefetcher:
+    """Fetches a target's data in the background before a command asks for it.
+
+    Jobs run one after another on a daemon thread, as tasks of their own scheduler family,
+    so they are throttled by its interval and never hold a slot of a foreground family.
+    They pause while a batch of any other family runs, so commands get the whole rate limit.
+    A job returning an iterator is consumed one page at a time, throttled per page, and
+    its result is the concatenation of the pages. Every result is handed out once: the
+    first command asking for it waits for the job if it is still running, and the job
+    stops throttling from then on. `done` is called on the worker thread after each run of jobs.
+    """
+
+    def __init__(self, scheduler: Scheduler, family: str = "prefetch", done: Callable[[], None] | None = None) -> None:
+        self.scheduler = scheduler
+        self.family = family
+        self.done = done
+        self.key: Any = None
+        self.results: dict[str, concurrent.futures.Future] = {}
+        self.cancelled = threading.Event()
+        self.hurry = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self, key: Any, jobs: dict[str, Callable[[], Any]]) -> None:
+        """Drop the results for the previous key and start fetching `jobs` for `key`."""
+        self.cancel()
+        with self._lock:
+            self.key = key
+            self.cancelled = threading.Event()
+            self.hurry = threading.Event()
+            self.results = {name: concurrent.futures.Future() for name in jobs}
+        threading.Thread(target=self._work, args=(jobs, self.results, self.cancelled, self.hurry), daemon=True).start()
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled.set()
+            for future in self.results.values():
+                future.cancel()
+            self.results = {}
+            self.key = None
+
+    def get(self, key: Any, name: str, fetch: Callable[[], Any]) -> Any:
+        """Prefetched result of `name` for `key`, or `fetch()` when there is none or the job failed."""
+        with self._lock:
+            future = self.results.pop(name, None) if key == self.key else None
+            if future and not future.done():
+                self.hurry.set()
+
+        if future:
+            try:
+                return future.result()
+            except Exception:
+                pass
+        return fetch()
+
+    def _work(self, jobs: dict[str, Callable[[], Any]], results: dict[str, concurrent.futures.Future],
+            cancelled: threading.Event, hurry: threading.Event) -> None:
+        for name, job in jobs.items():
+            future = results[name]
+            if cancelled.is_set() or not future.set_running_or_notify_cancel():
+                continue
+            self._wait_idle(cancelled, hurry)
+            try:
+                result = self.scheduler.run(self.family, lambda _: job(), None)
+                if isinstance(result, Iterator):
+                    result = self._pages(result, cancelled, hurry)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+        if self.done:
+            self.done()
+
+    def _pages(self, pages: Iterator[list], cancelled: threading.Event, hurry: threading.Event) -> list:
+        items = []
+        while True:
+            self.scheduler.wait_closed(self.family)
+            self._wait_idle(cancelled, hurry)
+            if not hurry.is_set():
+                self.scheduler.throttle(self.family)
+            if cancelled.is_set():
+                raise concurrent.futures.CancelledError()
+            if (page := next(pages, None)) is None:
+                return items
+            items.extend(page)
+
+    def _wait_idle(self, cancelled: threading.Event, hurry: threading.Event) -> None:
+        while self.scheduler.busy(self.family) and not hurry.is_set() and not cancelled.is_set():
+            time.sleep(0.1)
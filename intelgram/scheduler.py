@@ -0,0 +1,268 @@
+from __future__ import annotations
+import concurrent.futures
+from dataclasses import dataclass
+import queue
+import random
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator
+
+
+@dataclass
+class TaskError:
+    family: str
+    idx: int
+    item: Any
+    exception: Exception
+
+
+class Scheduler:
+    """Shared executor for every fan-out in Intelgram.
+
+    Tasks are grouped into families (one per endpoint, e.g. "comments" or "download").
+    A family's limit caps how many of its tasks run at once across all batches, and its
+    interval (in seconds) is the minimum time between two of its tasks starting.
+
+    Tasks failing with a transient error (as decided by `transient`, every error by default)
+    are retried with exponential backoff. After `breaker_threshold` transient failures in a row,
+    the family's circuit breaker opens and pauses the family for `breaker_cooldown` seconds.
+    One more failure after the pause opens it again. Other errors fail the task right away.
+    """
+
+    def __init__(self, limits: dict[str, int], intervals: dict[str, float] | None = None, max_workers: int = 32,
+            retries: int = 2, backoff: float = 2.0, breaker_threshold: int = 5, breaker_cooldown: float = 60.0,
+            transient: Callable[[Exception], bool] | None = None) -> None:
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.limits = limits
+        self.intervals = intervals or {}
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.is_transient = transient or (lambda e: True)
+        self._semaphores: dict[str, threading.BoundedSemaphore] = {}
+        self._next_start: dict[str, float] = {}
+        self._failures: dict[str, int] = {}
+        self._open_until: dict[str, float] = {}
+        self._active: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def map(self, func: Callable, items: Iterable, family: str = "default", workers: int | None = None) -> Batch:
+        return Batch(self, func, items, family, workers)
+
+    def stream(self, items: Iterable, maxsize: int = 64) -> Feed:
+        return Feed(items, maxsize)
+
+    def semaphore(self, family: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            if family not in self._semaphores:
+                self._semaphores[family] = threading.BoundedSemaphore(self.limits.get(family, self.limits["default"]))
+            return self._semaphores[family]
+
+    def run(self, family: str, func: Callable, item: Any) -> Any:
+        """Run one task of `family`, with retries and behind the family's circuit breaker."""
+        for attempt in range(self.retries + 1):
+            self.wait_closed(family)
+            self.throttle(family)
+            try:
+                result = func(item)
+            except Exception as e:
+                if not self.is_transient(e):
+                    raise
+                self._record(family, False)
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+            else:
+                self._record(family, True)
+                return result
+
+    def busy(self, exclude: str) -> bool:
+        """Whether a batch of any family but `exclude` is running."""
+        with self._lock:
+            return any(count for family, count in self._active.items() if family != exclude)
+
+    def is_open(self, family: str) -> bool:
+        return self._open_until.get(family, 0) > time.monotonic()
+
+    def wait_closed(self, family: str) -> None:
+        while (delay := self._open_until.get(family, 0) - time.monotonic()) > 0:
+            time.sleep(min(delay, 1))
+
+    def throttle(self, family: str) -> None:
+        """Block until the family's interval allows the next task to start."""
+        if not (interval := self.intervals.get(family)):
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start.get(family, now))
+            self._next_start[family] = start + interval
+        time.sleep(start - now)
+
+    def _activate(self, family: str, delta: int) -> None:
+        with self._lock:
+            self._active[family] = self._active.get(family, 0) + delta
+
+    def _record(self, family: str, success: bool) -> None:
+        with self._lock:
+            if success:
+                self._failures[family] = 0
+                return
+
+            self._failures[family] = self._failures.get(family, 0) + 1
+            if self._failures[family] >= self.breaker_threshold and not self.is_open(family):
+                self._open_until[family] = time.monotonic() + self.breaker_cooldown
+                self._failures[family] = self.breaker_threshold - 1
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class Feed:
+    """Bounded queue filled from `items` by a background producer thread.
+
+    Lets a batch start working on the first items while a slow producer (e.g. pagination)
+    is still running. `len()` is the number of items produced so far.
+    """
+
+    EMPTY = object()
+    _DONE = object()
+
+    def __init__(self, items: Iterable, maxsize: int) -> None:
+        self.queue = queue.Queue(maxsize)
+        self.count = 0
+        self.error: Exception | None = None
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self._produce, args=(items,), daemon=True)
+        self.thread.start()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator:
+        while (item := self.queue.get()) is not self._DONE:
+            yield item
+
+    def poll(self) -> Any:
+        """Next item, `Feed.EMPTY` if none is ready yet. Raises StopIteration when done."""
+        try:
+            item = self.queue.get_nowait()
+        except queue.Empty:
+            return self.EMPTY
+        if item is self._DONE:
+            raise StopIteration
+        return item
+
+    def close(self) -> None:
+        self.closed.set()
+
+    def _produce(self, items: Iterable) -> None:
+        try:
+            for item in items:
+                if not self._put(item):
+                    return
+                self.count += 1
+        except Exception as e:
+            self.error = e
+        self._put(self._DONE)
+
+    def _put(self, item: Any) -> bool:
+        while not self.closed.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+
+class Batch:
+    """One fan-out over `items`, iterated as (idx, item, result) in completion order.
+
+    Items are pulled lazily, so at most `workers` of them are in flight at any time.
+    `items` may be a Feed, in which case finished results are still yielded while
+    the producer is waiting for its next item.
+    Failed tasks are collected in `errors` instead of being yielded. Ctrl-C cancels
+    the queued work, marks the batch `cancelled` and is re-raised to the consumer.
+    """
+
+    def __init__(self, scheduler: Scheduler, func: Callable, items: Iterable, family: str, workers: int | None) -> None:
+        self.scheduler = scheduler
+        self.func = func
+        self.items = items
+        self.family = family
+        self.workers = workers or scheduler.limits.get(family, scheduler.limits["default"])
+        self.errors: list[TaskError] = []
+        self.completed = 0
+        self.cancelled = False
+
+    def __iter__(self) -> Iterator[tuple[int, Any, Any]]:
+        items = self._pull()
+        semaphore = self.scheduler.semaphore(self.family)
+        pending: dict[concurrent.futures.Future, tuple[int, Any]] = {}
+        exhausted = False
+        self.scheduler._activate(self.family, 1)
+
+        try:
+            while True:
+                while not exhausted and len(pending) < self.workers and semaphore.acquire(blocking=False):
+                    try:
+                        idx, item = next(items)
+                    except StopIteration:
+                        exhausted = True
+                    if exhausted or item is Feed.EMPTY:
+                        semaphore.release()
+                        break
+                    future = self.scheduler.executor.submit(self._call, item)
+                    future.add_done_callback(lambda _: semaphore.release())
+                    pending[future] = (idx, item)
+
+                if not pending:
+                    if exhausted:
+                        return
+                    # Waiting for the feed, or every slot of the family is held by another batch
+                    time.sleep(0.05)
+                    continue
+
+                done, _ = concurrent.futures.wait(pending, timeout=0.1, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    idx, item = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        self.errors.append(TaskError(self.family, idx, item, e))
+                    else:
+                        self.completed += 1
+                        yield idx, item, result
+        except KeyboardInterrupt:
+            self.cancelled = True
+            raise
+        finally:
+            self.scheduler._activate(self.family, -1)
+            for future in pending:
+                future.cancel()
+            if isinstance(self.items, Feed):
+                self.items.close()
+                if self.items.error:
+                    self.errors.append(TaskError(self.family, -1, "feed", self.items.error))
+
+    def _call(self, item: Any) -> Any:
+        return self.scheduler.run(self.family, self.func, item)
+
+    def _pull(self) -> Iterator[tuple[int, Any]]:
+        if not isinstance(self.items, Feed):
+            yield from enumerate(self.items)
+            return
+
+        idx = 0
+        while True:
+            try:
+                item = self.items.poll()
+            except StopIteration:
+                return
+            if item is Feed.EMPTY:
+                yield -1, item
+            else:
+                yield idx, item
+                idx += 1
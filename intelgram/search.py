@@ -0,0 +1,68 @@
+from __future__ import annotations
+import sqlite3
+import threading
+from typing import Any, Iterable
+
+
+class SearchIndex:
+    """SQLite FTS5 index over collected captions and comments.
+
+    Documents live in a regular table keyed by `doc_id` (e.g. "comment:<pk>"), the FTS table
+    is kept in sync by triggers. Re-indexing a document only touches the index when its text changed.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                rowid INTEGER PRIMARY KEY, doc_id TEXT UNIQUE, kind TEXT, target TEXT,
+                post_id TEXT, user_pk TEXT, created INTEGER, text TEXT
+            );
+            CREATE INDEX IF NOT EXISTS docs_target ON docs (target);
+            CREATE INDEX IF NOT EXISTS docs_post ON docs (post_id);
+            CREATE INDEX IF NOT EXISTS docs_user ON docs (user_pk);
+            CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(text, content='docs', content_rowid='rowid');
+            CREATE TRIGGER IF NOT EXISTS docs_ai AFTER INSERT ON docs BEGIN
+                INSERT INTO docs_fts (rowid, text) VALUES (new.rowid, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS docs_ad AFTER DELETE ON docs BEGIN
+                INSERT INTO docs_fts (docs_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS docs_au AFTER UPDATE ON docs BEGIN
+                INSERT INTO docs_fts (docs_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+                INSERT INTO docs_fts (rowid, text) VALUES (new.rowid, new.text);
+            END;
+        """)
+
+    def add(self, docs: Iterable[tuple[str, str, str, str, str | None, int, str]]) -> None:
+        """Insert or update (doc_id, kind, target, post_id, user_pk, created, text) rows."""
+        with self.lock:
+            self.db.executemany(
+                "INSERT INTO docs (doc_id, kind, target, post_id, user_pk, created, text) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (doc_id) DO UPDATE SET text = excluded.text WHERE text != excluded.text",
+                ((*doc[:6], doc[6] or "") for doc in docs)
+            )
+            self.db.commit()
+
+    def search(self, query: str, target: str = None, kind: str = None, post_id: str = None, user_pk: str = None,
+            since: int = None, until: int = None, limit: int = 50) -> list[dict[str, Any]]:
+        """Matches of an FTS5 query, best ranked first. Empty filters are ignored, `until` is exclusive."""
+        filters, params = [], [query]
+        for column, value in [("d.target = ?", target), ("d.kind = ?", kind), ("d.post_id = ?", post_id),
+                ("d.user_pk = ?", user_pk), ("d.created >= ?", since), ("d.created < ?", until)]:
+            if value:
+                filters.append(column)
+                params.append(value)
+
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT d.kind, d.target, d.post_id, d.user_pk, d.created, snippet(docs_fts, 0, '[', ']', '...', 16), bm25(docs_fts) "
+                "FROM docs_fts JOIN docs d ON d.rowid = docs_fts.rowid "
+                f"WHERE docs_fts MATCH ? {''.join(f'AND {f} ' for f in filters)}"
+                "ORDER BY bm25(docs_fts) LIMIT ?",
+                (*params, limit)
+            ).fetchall()
+
+        columns = ("kind", "target", "post_id", "user_pk", "created", "snippet", "rank")
+        return [dict(zip(columns, row)) for row in rows]
@@ -0,0 +1,154 @@
+from __future__ import annotations
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Collection
+
+from intelgram import output
+
+
+class JobQueue:
+    """Jobs persisted in SQLite, so queued jobs survive a restart of the server."""
+
+    COLUMNS = ("id", "command", "target", "extra_input", "status", "created", "started", "finished", "result", "error")
+
+    def __init__(self, path: str) -> None:
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.available = threading.Condition(self.lock)
+        with self.lock:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, command TEXT, target TEXT, extra_input TEXT, "
+                "status TEXT, created REAL, started REAL, finished REAL, result TEXT, error TEXT)"
+            )
+            # Jobs that were running when the server stopped are started again
+            self.db.execute("UPDATE jobs SET status = 'queued', started = NULL WHERE status = 'running'")
+            self.db.commit()
+
+    def add(self, command: str, target: str, extra_input: list[str]) -> int:
+        with self.lock:
+            cursor = self.db.execute(
+                "INSERT INTO jobs (command, target, extra_input, status, created) VALUES (?, ?, ?, 'queued', ?)",
+                (command, target, json.dumps(extra_input), time.time())
+            )
+            self.db.commit()
+            self.available.notify_all()
+            return cursor.lastrowid
+
+    def claim(self) -> dict[str, Any]:
+        """Block until a queued job is available whose target has no running job, and mark it running."""
+        with self.available:
+            while True:
+                row = self.db.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' AND target NOT IN "
+                    "(SELECT target FROM jobs WHERE status = 'running') ORDER BY id LIMIT 1"
+                ).fetchone()
+                if row:
+                    self.db.execute("UPDATE jobs SET status = 'running', started = ? WHERE id = ?", (time.time(), row[0]))
+                    self.db.commit()
+                    return self._job(row)
+                self.available.wait()
+
+    def finish(self, id: int, result: Any = None, error: str = None) -> None:
+        with self.lock:
+            self.db.execute(
+                "UPDATE jobs SET status = ?, finished = ?, result = ?, error = ? WHERE id = ?",
+                ("failed" if error else "done", time.time(), json.dumps(result, default=str), error, id)
+            )
+            self.db.commit()
+            self.available.notify_all()
+
+    def get(self, id: int) -> dict[str, Any] | None:
+        with self.lock:
+            row = self.db.execute("SELECT * FROM jobs WHERE id = ?", (id,)).fetchone()
+        return self._job(row) if row else None
+
+    def list(self) -> list[dict[str, Any]]:
+        with self.lock:
+            rows = self.db.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+        return [{k: v for k, v in self._job(row).items() if k != "result"} for row in rows]
+
+    def _job(self, row: tuple) -> dict[str, Any]:
+        job = dict(zip(self.COLUMNS, row))
+        job["extra_input"] = json.loads(job["extra_input"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+
+class JobServer(ThreadingHTTPServer):
+    """Local HTTP/JSON API over a JobQueue.
+
+    POST /jobs                {"command": ..., "target": ..., "extra_input": [...]}
+    GET  /jobs                all jobs without results
+    GET  /jobs/<id>           one job with its result (the files it wrote)
+    GET  /jobs/<id>/result    contents of the files the job wrote
+    """
+
+    def __init__(self, port: int, queue: JobQueue, run: Callable[[dict[str, Any]], Any], commands: Collection[str],
+            output_dir: str, workers: int) -> None:
+        super().__init__(("127.0.0.1", port), JobHandler)
+        self.queue = queue
+        self.run = run
+        self.commands = commands
+        self.output_dir = output_dir
+        for _ in range(workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def _work(self) -> None:
+        while True:
+            job = self.queue.claim()
+            try:
+                result = self.run(job)
+            except (Exception, SystemExit) as e:
+                self.queue.finish(job["id"], error=repr(e))
+            else:
+                self.queue.finish(job["id"], result)
+
+
+class JobHandler(BaseHTTPRequestHandler):
+    server: JobServer
+
+    def do_GET(self) -> None:
+        if self.path == "/jobs":
+            self._send(200, self.server.queue.list())
+        elif not (match := re.fullmatch(r"/jobs/(\d+)(/result)?", self.path)) or not (job := self.server.queue.get(int(match[1]))):
+            self._send(404, {"error": "Not found"})
+        elif not match[2]:
+            self._send(200, job)
+        elif job["status"] != "done":
+            self._send(409, {"error": f"Job is {job['status']}"})
+        else:
+            self._send(200, {filename: output.load(f"{self.server.output_dir}/{filename}") for filename in job["result"]["files"]})
+
+    def do_POST(self) -> None:
+        if self.path != "/jobs":
+            self._send(404, {"error": "Not found"})
+            return
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            command, target = body["command"], body["target"]
+            extra_input = [str(value) for value in body.get("extra_input", [])]
+        except (ValueError, KeyError, TypeError):
+            self._send(400, {"error": "Expected a JSON object with command and target"})
+            return
+
+        if command not in self.server.commands:
+            self._send(400, {"error": f"Invalid command: {command}"})
+            return
+
+        self._send(201, {"id": self.server.queue.add(command, target, extra_input)})
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send(self, code: int, data: Any) -> None:
+        body = json.dumps(data, ensure_ascii=False, default=str).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
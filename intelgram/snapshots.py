@@ -0,0 +1,134 @@
+from __future__ import annotations
+import sqlite3
+import threading
+import time
+from typing import Any
+
+import numpy as np
+
+from intelgram.userlist import UserList
+
+
+def merge_pks(a: np.ndarray, b: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Pks only in `a`, only in `b` and in both, of two sorted unique pk arrays.
+
+    The concatenation is two sorted runs, which the stable sort (timsort) merges in linear time.
+    """
+    values = np.concatenate([a, b])
+    order = np.argsort(values, kind="stable")
+    values = values[order]
+    from_b = order >= len(a)
+    equal = values[1:] == values[:-1]
+    both = np.zeros(len(values), dtype=bool)
+    both[1:] |= equal
+    both[:-1] |= equal
+    return values[~from_b & ~both], values[from_b & ~both], values[from_b & both]
+
+
+class SnapshotStore:
+    """Follower and following lists over time, stored as deltas in SQLite.
+
+    A snapshot holds the pks added and removed since the previous snapshot of the same
+    user and kind, and every FULL_EVERY-th snapshot holds the full sorted pk array, so
+    rebuilding one never replays more than FULL_EVERY deltas. A run without changes only
+    updates the `checked` time of the latest snapshot. Usernames and full names are kept
+    once per user in a shared table.
+    """
+
+    FULL_EVERY = 30
+
+    def __init__(self, path: str) -> None:
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS users (pk INTEGER PRIMARY KEY, username TEXT, full_name TEXT);
+            CREATE TABLE IF NOT EXISTS snapshots (
+                id INTEGER PRIMARY KEY, user_pk INTEGER, username TEXT, kind TEXT, created INTEGER,
+                checked INTEGER, count INTEGER, full INTEGER, added BLOB, removed BLOB
+            );
+            CREATE INDEX IF NOT EXISTS snapshots_user ON snapshots (user_pk, kind, id);
+        """)
+
+    def add(self, user_pk: int | str, username: str, kind: str, users: UserList) -> tuple[int, int, int]:
+        """Record the current `users` of a user, returns the snapshot id and the gained and lost counts."""
+        pks = np.unique(np.frombuffer(users.pks, dtype=np.uint64))
+        now = int(time.time())
+        with self.lock:
+            self.db.executemany(
+                "INSERT INTO users VALUES (?, ?, ?) ON CONFLICT (pk) DO UPDATE SET username = excluded.username, "
+                "full_name = excluded.full_name WHERE username != excluded.username OR full_name != excluded.full_name",
+                zip(map(int, users.pks), users.usernames, users.full_names)
+            )
+
+            latest = self.db.execute(
+                "SELECT id FROM snapshots WHERE user_pk = ? AND kind = ? ORDER BY id DESC LIMIT 1", (int(user_pk), kind)
+            ).fetchone()
+            previous = self._pks(latest[0]) if latest else np.array([], dtype=np.uint64)
+            lost, gained, _ = merge_pks(previous, pks)
+
+            if latest and not len(gained) and not len(lost):
+                self.db.execute("UPDATE snapshots SET checked = ? WHERE id = ?", (now, latest[0]))
+                self.db.commit()
+                return latest[0], 0, 0
+
+            deltas = self.db.execute(
+                "SELECT COUNT(*) FROM snapshots WHERE user_pk = ? AND kind = ? AND id > "
+                "(SELECT COALESCE(MAX(id), 0) FROM snapshots WHERE user_pk = ? AND kind = ? AND full = 1)",
+                (int(user_pk), kind, int(user_pk), kind)
+            ).fetchone()[0]
+            full = not latest or deltas + 1 >= self.FULL_EVERY
+            cursor = self.db.execute(
+                "INSERT INTO snapshots (user_pk, username, kind, created, checked, count, full, added, removed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (int(user_pk), username, kind, now, now, len(pks), full,
+                    (pks if full else gained).tobytes(), b"" if full else lost.tobytes())
+            )
+            self.db.commit()
+            return cursor.lastrowid, len(gained), len(lost)
+
+    def list(self, user_pk: int | str, kind: str) -> list[dict[str, Any]]:
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT id, created, checked, count, LENGTH(added) / 8, LENGTH(removed) / 8, full FROM snapshots "
+                "WHERE user_pk = ? AND kind = ? ORDER BY id", (int(user_pk), kind)
+            ).fetchall()
+        columns = ("id", "created", "checked", "count", "added", "removed", "full")
+        return [dict(zip(columns, row)) for row in rows]
+
+    def pks(self, id: int) -> np.ndarray:
+        with self.lock:
+            return self._pks(id)
+
+    def latest(self, username: str, kind: str) -> np.ndarray | None:
+        """Pks of the newest snapshot of a user, looked up by username."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT id FROM snapshots WHERE username = ? AND kind = ? ORDER BY id DESC LIMIT 1", (username, kind)
+            ).fetchone()
+            return self._pks(row[0]) if row else None
+
+    def users(self, pks: np.ndarray) -> dict[int, tuple[str, str]]:
+        """Username and full name of each pk, in chunks below SQLite's variable limit."""
+        users = {}
+        values = [int(pk) for pk in pks]
+        with self.lock:
+            for start in range(0, len(values), 500):
+                chunk = values[start:start + 500]
+                users.update((pk, (username, full_name)) for pk, username, full_name in self.db.execute(
+                    f"SELECT pk, username, full_name FROM users WHERE pk IN ({','.join('?' * len(chunk))})", chunk
+                ))
+        return users
+
+    def _pks(self, id: int) -> np.ndarray:
+        user_pk, kind = self.db.execute("SELECT user_pk, kind FROM snapshots WHERE id = ?", (id,)).fetchone()
+        rows = self.db.execute(
+            "SELECT full, added, removed FROM snapshots WHERE user_pk = ? AND kind = ? AND id <= ? AND id >= "
+            "(SELECT MAX(id) FROM snapshots WHERE user_pk = ? AND kind = ? AND id <= ? AND full = 1) ORDER BY id",
+            (user_pk, kind, id, user_pk, kind, id)
+        ).fetchall()
+
+        pks = np.frombuffer(rows[0][1], dtype=np.uint64)
+        for _, added, removed in rows[1:]:
+            kept = merge_pks(pks, np.frombuffer(removed, dtype=np.uint64))[0]
+            pks = np.sort(np.concatenate([kept, np.frombuffer(added, dtype=np.uint64)]), kind="stable")
+        return pks
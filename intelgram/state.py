@@ -0,0 +1,54 @@
+from __future__ import annotations
+import json
+import os
+import threading
+from typing import Any, Iterator
+
+
+class StateStore:
+    """JSON documents and logs kept between runs, e.g. per-post counters or the download manifest."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    def file(self, name: str) -> str:
+        return f"{self.path}/{name}"
+
+    def load(self, name: str, default: Any = None) -> Any:
+        try:
+            with open(self.file(f"{name}.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+
+    def append(self, name: str, record: dict[str, Any]) -> None:
+        """Append one record to the newline delimited JSON log `name`."""
+        with self._lock:
+            with open(self.file(f"{name}.ndjson"), "a") as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def replace_records(self, name: str, records: list[dict[str, Any]]) -> None:
+        path = self.file(f"{name}.ndjson")
+        with self._lock:
+            with open(f"{path}.tmp", "w") as f:
+                f.writelines(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in records)
+            os.replace(f"{path}.tmp", path)
+
+    def records(self, name: str) -> Iterator[dict[str, Any]]:
+        try:
+            with open(self.file(f"{name}.ndjson")) as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        except FileNotFoundError:
+            return
+
+    def save(self, name: str, data: Any) -> None:
+        # Write to a temporary file first, so an interrupted run never leaves a truncated state behind
+        path = self.file(f"{name}.json")
+        with self._lock:
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(data, f, ensure_ascii=False, default=str)
+            os.replace(f"{path}.tmp", path)
@@ -0,0 +1,185 @@
+from __future__ import annotations
+import concurrent.futures
+import html
+import os
+import shutil
+import subprocess
+import urllib.parse
+from typing import Callable
+
+from PIL import Image, ImageDraw
+
+from intelgram.media_index import VIDEO_EXTENSIONS
+from intelgram.state import StateStore
+
+THUMBNAIL_SIZE = 320
+SHEET_CELL = 160
+SHEET_COLUMNS = 8
+SHEET_ROWS = 6
+
+
+def make_thumbnail(path: str, thumbnail: str) -> bool:
+    """Write a JPEG thumbnail of an image, or a poster frame of a video. Runs in a worker process.
+
+    Returns False for videos when ffmpeg isn't installed.
+    """
+    if path.lower().endswith(VIDEO_EXTENSIONS):
+        if not (ffmpeg := shutil.which("ffmpeg")):
+            return False
+        # A frame one second in is more telling than the often black first one, short videos fall back to it
+        for seek in (["-ss", "1"], []):
+            subprocess.run(
+                [ffmpeg, "-loglevel", "error", "-y", *seek, "-i", path, "-frames:v", "1",
+                    "-vf", f"scale={THUMBNAIL_SIZE}:-2", f"{thumbnail}.tmp.jpg"],
+                stdin=subprocess.DEVNULL
+            )
+            if os.path.isfile(f"{thumbnail}.tmp.jpg"):
+                break
+        else:
+            raise RuntimeError(f"ffmpeg couldn't extract a frame of {path}")
+        with Image.open(f"{thumbnail}.tmp.jpg") as image:
+            _save(_play_marker(image.convert("RGB")), thumbnail)
+        os.remove(f"{thumbnail}.tmp.jpg")
+        return True
+
+    with Image.open(path) as image:
+        image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        _save(image.convert("RGB"), thumbnail)
+    return True
+
+
+def make_sheets(folder: str, entries: list[tuple[str, str, bool]]) -> list[str]:
+    """Contact sheets and an index.html of one target's (media path, thumbnail path, is video) entries.
+
+    Runs in a worker process. Returns the sheet filenames.
+    """
+    per_sheet = SHEET_COLUMNS * SHEET_ROWS
+    sheets = []
+    for page, start in enumerate(range(0, len(entries), per_sheet), 1):
+        chunk = entries[start:start + per_sheet]
+        sheet = Image.new("RGB", (SHEET_COLUMNS * SHEET_CELL, -(-len(chunk) // SHEET_COLUMNS) * SHEET_CELL), "white")
+        for idx, (_, thumbnail, _) in enumerate(chunk):
+            with Image.open(thumbnail) as image:
+                image.thumbnail((SHEET_CELL - 4, SHEET_CELL - 4))
+                x, y = idx % SHEET_COLUMNS * SHEET_CELL, idx // SHEET_COLUMNS * SHEET_CELL
+                sheet.paste(image, (x + (SHEET_CELL - image.width) // 2, y + (SHEET_CELL - image.height) // 2))
+        sheets.append(f"contact-sheet_{page:03}.jpg")
+        _save(sheet, f"{folder}/{sheets[-1]}")
+
+    # Sheets of an earlier, longer run of the same target
+    for name in os.listdir(folder):
+        if name.startswith("contact-sheet_") and name not in sheets:
+            os.remove(f"{folder}/{name}")
+
+    def link(path: str) -> str:
+        return html.escape(urllib.parse.quote(os.path.relpath(path, folder)))
+
+    cells = "\n".join(
+        f'<a href="{link(path)}" title="{html.escape(os.path.basename(path))}"><img src="{link(thumbnail)}" loading="lazy">'
+        f'{"<span>video</span>" if video else ""}</a>'
+        for path, thumbnail, video in entries
+    )
+    sheet_links = " ".join(f'<a href="{name}">{name}</a>' for name in sheets)
+    with open(f"{folder}/index.html", "w") as f:
+        f.write(
+            "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>"
+            f"{html.escape(os.path.basename(folder))}</title><style>"
+            "body{font-family:sans-serif} div{display:flex;flex-wrap:wrap;gap:4px} a{position:relative}"
+            "img{width:160px;height:160px;object-fit:cover} span{position:absolute;left:4px;top:4px;"
+            "background:#000a;color:#fff;font-size:12px;padding:1px 4px}"
+            f"</style></head><body>\n<p>{len(entries)} files. Contact sheets: {sheet_links}</p>\n<div>\n{cells}\n</div>\n</body></html>\n"
+        )
+    return sheets
+
+
+def _play_marker(image: Image.Image) -> Image.Image:
+    size = max(12, min(image.size) // 5)
+    x, y = (image.width - size) // 2, (image.height - size) // 2
+    ImageDraw.Draw(image).polygon([(x, y), (x, y + size), (x + size, y + size // 2)], fill="white", outline="black")
+    return image
+
+
+def _save(image: Image.Image, path: str) -> None:
+    image.save(f"{path}.tmp", "JPEG", quality=80)
+    os.replace(f"{path}.tmp", path)
+
+
+class Thumbnails:
+    """Thumbnails, video poster frames and per-target contact sheets of downloaded media.
+
+    Thumbnails live in `folder`/<target>/, next to the target's contact sheets and index.html.
+    The modification time of each processed file is kept in the state directory, so a run
+    only decodes new or changed files and only rebuilds the sheets of targets that changed.
+    """
+
+    def __init__(self, root: str, folder: str, state: StateStore) -> None:
+        self.root = root
+        self.folder = folder
+        self.state = state
+        self.processed: dict[str, dict] = state.load("thumbnails", {})
+        self.skipped: list[str] = []
+
+    def outdated(self, files: dict[str, str]) -> list[str]:
+        """Paths of `files` (path -> target) that are new or changed since their thumbnail was made."""
+        return [path for path in files if self.processed.get(path, {}).get("mtime") != os.path.getmtime(path)]
+
+    def update(self, files: dict[str, str], progress: Callable[[int, int], None] | None = None) -> list[tuple[str, Exception]]:
+        """Make the missing thumbnails and rebuild the sheets of changed targets in a process pool.
+
+        Returns the files that failed. Videos skipped because ffmpeg isn't installed are listed in `skipped`.
+        """
+        paths = self.outdated(files)
+        # Files that disappeared from the output dir are dropped from the sheets too
+        changed = {files[path] for path in paths}
+        for path in [path for path in self.processed if path not in files]:
+            entry = self.processed.pop(path)
+            changed.add(entry["target"])
+            if os.path.isfile(entry["thumbnail"]):
+                os.remove(entry["thumbnail"])
+        errors = []
+        self.skipped = []
+
+        with concurrent.futures.ProcessPoolExecutor() as executor:
+            futures = {}
+            for path in paths:
+                os.makedirs(f"{self.folder}/{files[path]}", exist_ok=True)
+                name = os.path.splitext(os.path.relpath(path, self.root))[0].replace(os.sep, "__")
+                thumbnail = f"{self.folder}/{files[path]}/{name}.jpg"
+                futures[executor.submit(make_thumbnail, path, thumbnail)] = (path, thumbnail)
+
+            try:
+                for count, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                    path, thumbnail = futures[future]
+                    try:
+                        made = future.result()
+                    except Exception as e:
+                        errors.append((path, e))
+                    else:
+                        if made:
+                            self.processed[path] = {
+                                "thumbnail": thumbnail,
+                                "target": files[path],
+                                "mtime": os.path.getmtime(path),
+                                "video": path.lower().endswith(VIDEO_EXTENSIONS)
+                            }
+                        else:
+                            self.skipped.append(path)
+                    if progress:
+                        progress(count, len(paths))
+            finally:
+                self.state.save("thumbnails", self.processed)
+
+            entries = {}
+            for path, entry in sorted(self.processed.items()):
+                entries.setdefault(entry["target"], []).append((path, entry["thumbnail"], entry["video"]))
+            sheet_futures = {
+                executor.submit(make_sheets, f"{self.folder}/{target}", entries.get(target, [])): target
+                for target in changed if os.path.isdir(f"{self.folder}/{target}")
+            }
+            for future in concurrent.futures.as_completed(sheet_futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append((f"{self.folder}/{sheet_futures[future]}", e))
+
+        return errors
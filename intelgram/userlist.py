@@ -0,0 +1,62 @@
+from __future__ import annotations
+from array import array
+import sys
+from typing import Any, Iterable, Iterator
+
+from intelgram.pks import PkSet
+
+
+class UserList:
+    """Compact column store for user lists (followers, followings, likers).
+
+    Pks are kept in an unsigned 64 bit array, usernames and full names as interned strings.
+    Any other field is only stored when it is listed in `fields`. Iterating yields plain
+    user dicts, built on the fly, so commands can treat it like a list of `.dict()`s.
+    A user that is already in the list is skipped, pages of a paginated endpoint overlap.
+    """
+
+    def __init__(self, users: Iterable = (), fields: Iterable[str] = ()) -> None:
+        self.pks = array("Q")
+        self.usernames: list[str] = []
+        self.full_names: list[str] = []
+        self.fields: dict[str, list] = {field: [] for field in fields}
+        self._index = PkSet()
+        self.extend(users)
+
+    def __contains__(self, user: dict[str, Any] | int | str) -> bool:
+        return (user["pk"] if isinstance(user, dict) else user) in self._index
+
+    def __getitem__(self, idx: int) -> dict[str, Any]:
+        return {
+            "pk": str(self.pks[idx]),
+            "username": self.usernames[idx],
+            "full_name": self.full_names[idx],
+            **{field: values[idx] for field, values in self.fields.items()}
+        }
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        return (self[idx] for idx in range(len(self.pks)))
+
+    def __len__(self) -> int:
+        return len(self.pks)
+
+    def append(self, user: Any) -> None:
+        """Add a pydantic user model or a user dict, unless a user with the same pk is already in the list."""
+        if not isinstance(user, dict) and self.fields:
+            # Nested models (e.g. stories) are stored the way `.dict()` outputs them
+            user = user.dict()
+        get = user.get if isinstance(user, dict) else lambda field, default=None: getattr(user, field, default)
+        if not self._index.add(get("pk")):
+            return
+        self.pks.append(int(get("pk")))
+        self.usernames.append(sys.intern(get("username") or ""))
+        self.full_names.append(sys.intern(get("full_name") or ""))
+        for field, values in self.fields.items():
+            values.append(get(field))
+
+    def extend(self, users: Iterable) -> None:
+        for user in users:
+            self.append(user)
+
+    def to_list(self) -> list[dict[str, Any]]:
+        return list(self)
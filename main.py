@@ -1,6 +1,9 @@
+import signal
+
 import inteltk
 from inteltk.colors import *
 
+from intelgram import output
 from intelgram.intelgram import Intelgram
 from intelgram.logo import ascii_logo
 from intelgram.colors import *
@@ -9,11 +12,14 @@ parser = inteltk.create_parser(ascii_logo)
 parser.add_argument("target", help="Target's username")
 parser.add_argument("-c", "--command", help="Run command directly, without interaction", metavar="command", action="append")
 parser.add_argument("-e", "--extra-input", help="Add extra inputs for commands which ask the user", metavar="input", action="append")
+parser.add_argument("-f", "--format", help="JSON output format (default: json)", choices=output.available_formats(), action="store")
 parser.add_argument("-i", "--interactive", help="Force interactive mode", action="store_true")
 parser.add_argument("-j", "--json", help="Save output to .json", action="store_true")
 parser.add_argument("-o", "--output", help="Output directory", metavar="output_dir", action="store")
+parser.add_argument("-p", "--prefetch", help="Fetch target's posts and info in the background, while waiting for a command", action="store_true")
 parser.add_argument("-s", "--style", help="Set a valid PrettyTable style (only for txt exports)", metavar="style", action="store")
 parser.add_argument("-t", "--txt", help="Save output to .txt", action="store_true")
+parser.add_argument("-u", "--update", help="Only fetch posts that changed since the last run (comments, likers)", action="store_true")
 parser.add_argument("-v", "--verification-code", help="Set the 2fa code", metavar="code", action="store")
 
 args = parser.parse_args()
@@ -24,10 +30,22 @@ COMMANDS = {
         "func": client.captions,
         "desc": "\t\tGet the caption of target's posts"
     },
+    "cohort-overlap": {
+        "func": client.cohort_overlap,
+        "desc": "\t\tAudience overlap matrix between a list of users"
+    },
     "comments": {
         "func": client.comments,
         "desc": "\t\tGet the comments on target's posts"
     },
+    "engagement": {
+        "func": client.engagement,
+        "desc": "\t\tEngagement statistics of target or a list of users"
+    },
+    "follower-diff": {
+        "func": client.follower_diff,
+        "desc": "\t\tAccounts gained and lost between two follower snapshots"
+    },
     "followers": {
         "func": client.followers,
         "desc": "\t\tList target's followers"
@@ -44,6 +62,10 @@ COMMANDS = {
         "func": client.followings_subset,
         "desc": "\tFind common followings between target and target2"
     },
+    "graph-crawl": {
+        "func": client.graph_crawl,
+        "desc": "\t\tCrawl the followings graph from target or seed users"
+    },
     "hashtags": {
         "func": client.hashtags,
         "desc": "\t\tGet hashtags on target's posts"
@@ -60,6 +82,10 @@ COMMANDS = {
         "func": client.info_list,
         "desc": "\t\tGet user infos from a .json file"
     },
+    "interactions": {
+        "func": client.interactions,
+        "desc": "\t\tRank users by their interactions with target"
+    },
     "likers": {
         "func": client.likers,
         "desc": "\t\t\tGet likers on target's posts"
@@ -92,6 +118,26 @@ COMMANDS = {
         "func": client.profile_pic,
         "desc": "\t\tDownload target's profile picture"
     },
+    "profile-pics-list": {
+        "func": client.profile_pics_list,
+        "desc": "\tDownload the profile pictures of users in a .json file"
+    },
+    "retry": {
+        "func": client.retry,
+        "desc": "\t\t\tFetch the items that failed in earlier commands again"
+    },
+    "search": {
+        "func": client.search,
+        "desc": "\t\tSearch collected captions and comments"
+    },
+    "serve": {
+        "func": client.serve,
+        "desc": "\t\t\tServe commands as jobs over a local HTTP API"
+    },
+    "similar-media": {
+        "func": client.similar_media,
+        "desc": "\t\tFind near-duplicate downloaded media across targets"
+    },
     "stories": {
         "func": client.stories,
         "desc": "\t\t\tDownload target's stories"
@@ -112,9 +158,17 @@ COMMANDS = {
         "func": client.target,
         "desc": "\t\t\tChange target",
     },
+    "thumbnails": {
+        "func": client.thumbnails,
+        "desc": "\t\tThumbnails and contact sheets of downloaded media"
+    },
     "viewcount": {
         "func": client.viewcount,
         "desc": "\t\tGet target's viewcount",
+    },
+    "watch": {
+        "func": client.watch,
+        "desc": "\t\t\tKeep downloading new stories of a list of users"
     }
 }
 
@@ -145,9 +199,29 @@ def main() -> None:
             case "txt=n":
                 client.txt = False
                 printcolor(f"TXT output {RED}disabled", BLUE)
+            case "prefetch=y":
+                client.prefetch = True
+                printcolor(f"Background prefetch {GREEN}enabled", BLUE)
+            case "prefetch=n":
+                client.prefetch = False
+                printcolor(f"Background prefetch {RED}disabled", BLUE)
+            case "update=y":
+                client.update = True
+                printcolor(f"Incremental update {GREEN}enabled", BLUE)
+            case "update=n":
+                client.update = False
+                printcolor(f"Incremental update {RED}disabled", BLUE)
             case _:
                 if command in COMMANDS:
-                    COMMANDS[command]["func"]()
+                    # Ctrl-C cancels the running command, only at the prompt it exits the program
+                    signal.signal(signal.SIGINT, signal.default_int_handler)
+                    try:
+                        COMMANDS[command]["func"]()
+                    except KeyboardInterrupt:
+                        print()
+                        printcolor("Command cancelled", YELLOW)
+                    finally:
+                        inteltk.set_exit_program(itk._exit_program)
                 else:
                     printcolor("Invalid command", RED)
 